@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Memory and latency benchmark of the cluster fetch paths.
+
+"dict_list" is the old path: one dict per row, then pd.DataFrame(rows).
+"arrow" reads the result column by column and dictionary-encodes the
+low-cardinality columns (pandas categoricals).
+
+Usage:
+  python -m benchmarks.bench_bq_fetch [--rows 200000]
+  python -m benchmarks.bench_bq_fetch --live PROJECT.DATASET.TABLE [--storage-api]
+
+Offline, a synthetic Arrow table plays the query result, so only the
+client-side materialization is measured. With --live, both real query
+functions of services/bq_service.py are timed end to end.
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, time as dtime, timedelta, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+from config.settings import CLUSTER_COLUMNS
+from services.bq_service import _dictionary_encode
+
+
+def synthetic_result(n_rows: int, seed: int = 42) -> pa.Table:
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    return pa.table({
+        "cluster_id": [f"cluster_{i:07d}" for i in range(n_rows)],
+        "content_interest": [rnd.choice(["esportes", "noticias", "receitas"]) for _ in range(n_rows)],
+        "location": [rnd.choice(["São Paulo", "Rio de Janeiro", "Belo Horizonte", "Recife", "Porto Alegre"]) for _ in range(n_rows)],
+        "previous_engagement": [rnd.choice(["push", "email"]) for _ in range(n_rows)],
+        "is_subscriber": [rnd.random() < 0.3 for _ in range(n_rows)],
+        "device_type": [rnd.choice(["mobile", "smart_tv", "web"]) for _ in range(n_rows)],
+        "access_time": [dtime(rnd.randrange(24), rnd.randrange(60)) for _ in range(n_rows)],
+        "avg_daily_minutes": [round(rnd.uniform(1, 180), 1) for _ in range(n_rows)],
+        "age": [rnd.randrange(18, 80) for _ in range(n_rows)],
+        "last_access": [now - timedelta(days=rnd.randrange(90)) for _ in range(n_rows)],
+    })
+
+
+def _measure(build) -> dict:
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    df = build()
+    elapsed = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": round(elapsed, 4),
+        "peak_mb": round(peak / 2**20, 1),
+        "dataframe_mb": round(df.memory_usage(deep=True).sum() / 2**20, 1),
+        "rows": len(df),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--live", metavar="PROJECT.DATASET.TABLE", help="query a real table")
+    parser.add_argument("--storage-api", action="store_true", help="use the Storage Read API (--live)")
+    args = parser.parse_args()
+
+    if args.live:
+        from services.bq_service import get_marketing_clusters, get_marketing_clusters_df
+        project, dataset, table = args.live.split(".")
+        report = {
+            "dict_list": _measure(lambda: pd.DataFrame(get_marketing_clusters(project, dataset, table, columns=CLUSTER_COLUMNS))),
+            "arrow": _measure(lambda: get_marketing_clusters_df(project, dataset, table, columns=CLUSTER_COLUMNS,
+                                                                use_storage_api=args.storage_api)),
+        }
+    else:
+        result = synthetic_result(args.rows)
+        report = {
+            "dict_list": _measure(lambda: pd.DataFrame(result.to_pylist())),
+            "arrow": _measure(lambda: _dictionary_encode(result).to_pandas()),
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
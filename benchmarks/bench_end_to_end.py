@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Offline end-to-end benchmark of the app's hot path, from the cluster query to the
+generated campaigns, at several table sizes.
+
+BigQuery is replaced by FakeBigQueryClient serving a synthetic table with the real
+schema (bench_bq_fetch.synthetic_result) and Gemini by FakeGenerativeModel, with
+configurable latency, token counts and injected errors. Stages timed per size:
+
+  load          get_marketing_clusters_arrow + to_pandas (query result -> DataFrame)
+  snapshot      SnapshotStore refresh from the fake source, then the memory-mapped load
+  last_access   timestamp -> days ago, as in load_and_prepare_data
+  filter        FilterIndex build, option counts and filter (bench_filter_index state)
+  rules         apply_rules on the filtered clusters
+  prompt        chunking and batch prompts of the filtered clusters
+  generate      bulk path of the UI: rules + dedup + suggest_copy_for_clusters
+  concurrent    single-cluster path over gemini_runner, on a sample of clusters
+
+Usage:
+  python -m benchmarks.bench_end_to_end [--rows 1000 100000 1000000] [--output results.json]
+  python -m benchmarks.bench_end_to_end --baseline results.json [--tolerance 1.25]
+
+The report is JSON. With --baseline, the stage times are compared with a
+previous report and the exit status is 1 when a stage got slower than the
+tolerance allows.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from benchmarks.bench_bq_fetch import synthetic_result
+from benchmarks.bench_filter_index import FILTER_COLUMNS, FILTER_STATE
+from config.settings import CLUSTER_COLUMNS
+from services import bq_service
+from services.dedup_service import suggest_with_dedup
+from services.fake_bigquery import FakeBigQueryClient
+from services.fake_gemini import FakeGenerativeModel
+from services.filter_index import FilterIndex
+from services.gemini_runner import suggest_campaigns_concurrently
+from services.gemini_service import _build_batch_prompt, chunk_rows, suggest_copy_for_clusters, usage
+from services.prompt_encoding import estimate_tokens
+from services.rule_engine import apply_rules
+from services.snapshot_service import SnapshotStore, bigquery_source
+
+TABLE = ("bench-project", "bench_dataset", "clusters")
+NOTES = "Divulgar a rodada do fim de semana."
+
+# Stages compared against a baseline (seconds).
+TIMED_STAGES = ["load", "snapshot", "last_access", "filter", "rules", "prompt", "generate", "concurrent"]
+# Shorter stages are left out of the comparison: their timings are mostly noise.
+MIN_COMPARED_SECONDS = 0.01
+
+
+def _timed(fn):
+    started_at = time.perf_counter()
+    result = fn()
+    return result, round(time.perf_counter() - started_at, 4)
+
+
+def convert_last_access(df: pd.DataFrame) -> pd.DataFrame:
+    # Same row-wise conversion as load_and_prepare_data in ui/streamlit_ui.py
+    now = datetime.now(timezone.utc)
+    df["last_access"] = df["last_access"].apply(lambda ts: 0 if pd.isna(ts) else (now - ts).days)
+    return df
+
+
+def _usage_delta(before: tuple) -> dict:
+    return {"calls": usage.calls - before[0], "prompt_tokens": usage.prompt_tokens - before[1],
+            "output_tokens": usage.output_tokens - before[2]}
+
+
+def _fake_model(args) -> FakeGenerativeModel:
+    return FakeGenerativeModel(latency_s=args.latency, jitter_s=args.jitter,
+                               seconds_per_1k_tokens=args.seconds_per_1k_tokens, output_tokens=args.output_tokens,
+                               error_rate=args.error_rate, error_code=503, invalid_rate=args.invalid_rate, seed=42)
+
+
+def run_size(n_rows: int, args) -> dict:
+    report = {"rows": n_rows}
+    client = FakeBigQueryClient(synthetic_result(n_rows))
+    bq_service.set_client(client)
+    try:
+        # warm-up: the first query also pays for importing the BigQuery SDK
+        bq_service.get_marketing_clusters_arrow(*TABLE, limit=1)
+        df, report["load"] = _timed(
+            lambda: bq_service.get_marketing_clusters_arrow(*TABLE, columns=CLUSTER_COLUMNS).to_pandas()
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            store = SnapshotStore(directory)
+            _, report["snapshot"] = _timed(
+                lambda: (store.refresh(bigquery_source(*TABLE, columns=CLUSTER_COLUMNS)), store.load().to_pandas())
+            )
+    finally:
+        bq_service.set_client(None)
+
+    df, report["last_access"] = _timed(lambda: convert_last_access(df))
+
+    def filter_stage():
+        index = FilterIndex(df, FILTER_COLUMNS)
+        for column in FILTER_COLUMNS:
+            index.option_counts(column, FILTER_STATE)
+        return index.filter(FILTER_STATE)
+
+    filtered_df, report["filter"] = _timed(filter_stage)
+    report["filtered_rows"] = len(filtered_df)
+
+    rules, report["rules"] = _timed(lambda: apply_rules(filtered_df))
+    plan = {record.pop("cluster_id"): record for record in rules.to_dict("records")}
+    rows = filtered_df.to_dict("records")
+
+    prompts, report["prompt"] = _timed(
+        lambda: [_build_batch_prompt(chunk, NOTES) for chunk in chunk_rows(rows)]
+    )
+    report["prompts"] = len(prompts)
+    report["prompt_tokens"] = sum(estimate_tokens(prompt) for prompt in prompts)
+
+    model = _fake_model(args)
+    before = (usage.calls, usage.prompt_tokens, usage.output_tokens)
+    (campaigns, dedup_report), report["generate"] = _timed(lambda: suggest_with_dedup(
+        rows, NOTES, api_key="offline",
+        generate=lambda representatives: suggest_copy_for_clusters(
+            representatives, NOTES, api_key="offline", plan=plan, model=model
+        ),
+        overrides={cluster_id: {"horario": fields["horario"]} for cluster_id, fields in plan.items()},
+    ))
+    report["generate_detail"] = {
+        **_usage_delta(before),
+        "groups": dedup_report.groups,
+        "campaigns": len(campaigns),
+        "missing": len(rows) - len(campaigns),
+        "clusters_per_s": round(len(rows) / report["generate"], 1) if report["generate"] else None,
+    }
+
+    sample = rows[:args.concurrent_rows]
+    before = (usage.calls, usage.prompt_tokens, usage.output_tokens)
+    results, report["concurrent"] = _timed(lambda: suggest_campaigns_concurrently(
+        sample, NOTES, api_key="offline", model=_fake_model(args),
+        requests_per_minute=args.requests_per_minute, tokens_per_minute=None, base_delay=0.05, max_delay=1.0,
+    ))
+    report["concurrent_detail"] = {
+        **_usage_delta(before),
+        "clusters": len(sample),
+        "failed": sum(not result.ok for result in results),
+        "retries": sum(result.attempts - 1 for result in results),
+        "clusters_per_s": round(len(sample) / report["concurrent"], 1) if report["concurrent"] else None,
+    }
+    return report
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns the (rows, stage, baseline_s, current_s) of the stages slower than `tolerance` x baseline.
+    """
+    previous = {size["rows"]: size for size in baseline["sizes"]}
+    regressions = []
+    for size in report["sizes"]:
+        for stage in TIMED_STAGES:
+            before = previous.get(size["rows"], {}).get(stage)
+            if before and before >= MIN_COMPARED_SECONDS and size[stage] > before * tolerance:
+                regressions.append((size["rows"], stage, before, size[stage]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency per call (s)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="fake model extra random latency (s)")
+    parser.add_argument("--seconds-per-1k-tokens", type=float, default=0.01, help="fake latency per 1k prompt tokens")
+    parser.add_argument("--output-tokens", type=int, default=60, help="fake output tokens per campaign")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fake 503 errors per call")
+    parser.add_argument("--invalid-rate", type=float, default=0.05, help="fake invalid campaigns")
+    parser.add_argument("--concurrent-rows", type=int, default=200, help="clusters sent one by one")
+    parser.add_argument("--requests-per-minute", type=float, default=6000)
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--baseline", help="report of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown vs the baseline")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    report = {
+        "commit": _commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "sizes": [run_size(n_rows, args) for n_rows in args.rows],
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        for rows, stage, before, after in regressions:
+            print(f"REGRESSION {stage} @ {rows} rows: {before:.3f}s -> {after:.3f}s", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Per-rerun latency of the UI filter stage: chained `isin` masks over a copy of the
+DataFrame plus unique() per column (old) against the bitmap FilterIndex (new).
+
+Usage:
+  python -m benchmarks.bench_filter_index [--rows 300000] [--reruns 50]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from benchmarks.bench_bq_fetch import synthetic_result
+from services.filter_index import FilterIndex
+
+FILTER_COLUMNS = ["content_interest", "location", "previous_engagement", "is_subscriber", "device_type", "age"]
+
+FILTER_STATE = {
+    "content_interest": ["esportes", "receitas"],
+    "location": ["São Paulo", "Recife"],
+    "previous_engagement": [],
+    "is_subscriber": [False],
+    "device_type": ["mobile"],
+    "age": list(range(18, 45)),
+}
+
+
+def rerun_pandas(all_df):
+    options = {column: all_df[column].unique().tolist() for column in FILTER_COLUMNS}
+    filtered_df = all_df.copy()
+    for column in FILTER_COLUMNS:
+        if FILTER_STATE[column]:
+            filtered_df = filtered_df[filtered_df[column].isin(FILTER_STATE[column])]
+    return options, filtered_df
+
+
+def rerun_index(index):
+    options = {column: index.option_counts(column, FILTER_STATE) for column in FILTER_COLUMNS}
+    return options, index.filter(FILTER_STATE)
+
+
+def _time(fn, arg, reruns: int) -> dict:
+    samples = []
+    for _ in range(reruns):
+        started_at = time.perf_counter()
+        _, filtered_df = fn(arg)
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return {"p50_ms": round(statistics.median(samples), 2),
+            "p95_ms": round(sorted(samples)[int(len(samples) * 0.95) - 1], 2),
+            "rows": len(filtered_df)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--reruns", type=int, default=50)
+    args = parser.parse_args()
+
+    all_df = synthetic_result(args.rows).to_pandas()
+    started_at = time.perf_counter()
+    index = FilterIndex(all_df, FILTER_COLUMNS)
+    build_ms = (time.perf_counter() - started_at) * 1000
+
+    report = {
+        "pandas": _time(rerun_pandas, all_df, args.reruns),
+        "index": {**_time(rerun_index, index, args.reruns), "build_ms": round(build_ms, 1)},
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the per-call Gemini setup, before and after the model registry.
+
+"before" reproduces the old path: genai.configure + a new GenerativeModel on every
+call, with SYSTEM_INSTRUCTION pasted into the prompt. "after" reuses the model from
+get_model, which carries the rules as a system instruction.
+
+Usage:
+  python -m benchmarks.bench_model_setup [--iterations 200] [--live]
+
+Without --live, prompt tokens are estimated locally. With --live (needs
+GEMINI_API_KEY), one request per mode is sent and the billed prompt tokens and
+context-cached tokens are read from usage_metadata.
+"""
+import argparse
+import json
+import statistics
+import time
+
+import google.generativeai as genai
+
+from config.settings import MODEL_GEMINI, get_api_key
+from services.gemini_service import SYSTEM_INSTRUCTION, estimate_tokens, get_model
+
+SAMPLE_CLUSTER = {
+    "cluster_id": "bench-1",
+    "content_interest": "esportes",
+    "location": "São Paulo",
+    "previous_engagement": "push",
+    "is_subscriber": False,
+    "device_type": "mobile",
+    "access_time": "20:10:00",
+    "avg_daily_minutes": 42.5,
+    "age": 22,
+    "last_access": 3,
+}
+SAMPLE_NOTES = "Divulgar a rodada do fim de semana."
+
+
+def _user_prompt(with_system_instruction: bool) -> str:
+    prefix = f"Instruções do sistema: {SYSTEM_INSTRUCTION}\n\n" if with_system_instruction else ""
+    return (
+        f"{prefix}Com base no cluster e nas notas do usuário a seguir, proponha uma campanha coesa. "
+        f"Cluster JSON:\n{json.dumps(SAMPLE_CLUSTER, ensure_ascii=False)}\n\n"
+        f"Notas do usuário/Objetivo da Campanha:\n{SAMPLE_NOTES}"
+    )
+
+
+def _setup_before(api_key: str):
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(MODEL_GEMINI), _user_prompt(with_system_instruction=True)
+
+
+def _setup_after(api_key: str):
+    return get_model(api_key, MODEL_GEMINI), _user_prompt(with_system_instruction=False)
+
+
+def _time_setup(setup, api_key: str, iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        started_at = time.perf_counter()
+        setup(api_key)
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return {"mean_ms": statistics.mean(samples), "p95_ms": sorted(samples)[int(len(samples) * 0.95) - 1]}
+
+
+def _live_tokens(model, prompt: str) -> dict:
+    resp = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
+    usage = resp.usage_metadata
+    return {
+        "prompt_tokens": usage.prompt_token_count,
+        "cached_tokens": getattr(usage, "cached_content_token_count", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--live", action="store_true", help="send one real request per mode")
+    args = parser.parse_args()
+
+    api_key = get_api_key() or "offline-benchmark-key"
+    report = {}
+    for name, setup in (("before", _setup_before), ("after", _setup_after)):
+        report[name] = _time_setup(setup, api_key, args.iterations)
+        model, prompt = setup(api_key)
+        if args.live:
+            report[name].update(_live_tokens(model, prompt))
+        else:
+            # The system instruction is counted in both modes: it is still sent,
+            # only context caching (GEMINI_CONTEXT_CACHE) bills it at the cached rate.
+            report[name]["prompt_tokens_estimate"] = estimate_tokens(prompt) + (
+                0 if name == "before" else estimate_tokens(SYSTEM_INSTRUCTION)
+            )
+            report[name]["user_prompt_tokens_estimate"] = estimate_tokens(prompt)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
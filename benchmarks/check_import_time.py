@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time budget check for the modules loaded at UI startup.
+
+Runs `python -X importtime` in a fresh interpreter and exits with status 1 when
+the total import time exceeds the budget, or when a heavy SDK that must only be
+loaded on first use shows up at import time.
+
+Usage:
+  python -m benchmarks.check_import_time [--budget-ms 1500] [--repeat 3]
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+# Modules imported by ui/streamlit_ui.py before the first render.
+STARTUP_MODULES = [
+    "config.settings",
+    "services.bq_service",
+    "services.cache_service",
+    "services.dedup_service",
+    "services.filter_index",
+    "services.gemini_service",
+    "services.job_queue",
+    "services.metrics",
+    "services.prompt_encoding",
+    "services.result_store",
+    "services.rule_engine",
+    "services.snapshot_service",
+]
+
+# SDKs that must stay deferred until the first query / generation.
+FORBIDDEN_AT_STARTUP = [
+    "google.generativeai",
+    "google.cloud.bigquery",
+    "google.cloud.bigquery_storage",
+]
+
+# Total import time allowed, in milliseconds.
+DEFAULT_BUDGET_MS = 1500.0
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure() -> dict:
+    """
+    Returns the cumulative import time (µs) of every top-level module import.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(STARTUP_MODULES)],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # nesting is shown as extra indentation after the single separator space
+        cumulative[name[1:].rstrip()] = int(cumulative_us)
+    return cumulative
+
+
+def check(budget_ms: float = DEFAULT_BUDGET_MS, repeat: int = 3) -> Tuple[float, dict, List[str]]:
+    """
+    Measures the startup imports `repeat` times and checks the fastest run.
+
+    Returns:
+      The total import time (ms), the cumulative time (µs) of each module of that
+      run, and the failures (deferred SDKs imported, budget exceeded).
+    """
+    runs = [measure() for _ in range(repeat)]
+    # Only top-level entries (no leading spaces) add up to the total.
+    totals = [sum(us for name, us in run.items() if not name.startswith(" ")) for run in runs]
+    best = runs[totals.index(min(totals))]
+    total_ms = min(totals) / 1000
+
+    failures = []
+    loaded = {name.strip() for name in best}
+    for module in FORBIDDEN_AT_STARTUP:
+        if module in loaded:
+            failures.append(f"{module} is imported at startup; it must be deferred to first use")
+    if total_ms > budget_ms:
+        failures.append(f"import time {total_ms:.0f} ms exceeds the budget of {budget_ms:.0f} ms")
+    return total_ms, best, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=3, help="runs; the fastest one is used")
+    args = parser.parse_args()
+
+    total_ms, best, failures = check(args.budget_ms, args.repeat)
+    slowest = sorted(((us, name.strip()) for name, us in best.items() if not name.startswith(" ")), reverse=True)[:10]
+    for us, name in slowest:
+        print(f"{us / 1000:8.1f} ms  {name}")
+    print(f"{total_ms:8.1f} ms  total (budget {args.budget_ms:.0f} ms)")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
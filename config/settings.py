@@ -19,6 +19,68 @@ logging.basicConfig(level=logging.ERROR)
 # Specifies the Gemini model to use for campaign suggestions.
 MODEL_GEMINI = "gemini-2.5-pro"
 
+# Tiered routing: campaigns are first generated with the fast model and only the
+# ones that fail validation are escalated to MODEL_GEMINI.
+MODEL_ROUTING = os.environ.get("MODEL_ROUTING", "true").lower() == "true"
+MODEL_GEMINI_FAST = os.environ.get("MODEL_GEMINI_FAST", "gemini-2.5-flash")
+# Repair requests allowed on the fast model before escalating.
+MODEL_GEMINI_FAST_MAX_REPAIRS = int(os.environ.get("MODEL_GEMINI_FAST_MAX_REPAIRS", 1))
+
+# Columns of the cluster table used by the app (BigQuery column projection).
+CLUSTER_COLUMNS = [
+    "cluster_id", "content_interest", "location", "previous_engagement", "is_subscriber",
+    "device_type", "access_time", "avg_daily_minutes", "age", "last_access",
+]
+
+# Store the fixed system prompt in an explicit Gemini context cache.
+GEMINI_CONTEXT_CACHE = os.environ.get("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL_SECONDS", 3600))
+
+# Limits of the concurrent Gemini fan-out (see services/gemini_runner.py).
+GEMINI_CONCURRENCY = int(os.environ.get("GEMINI_CONCURRENCY", 8))
+GEMINI_REQUESTS_PER_MINUTE = int(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", 60))
+GEMINI_TOKENS_PER_MINUTE = int(os.environ.get("GEMINI_TOKENS_PER_MINUTE", 250000))
+# Output tokens charged to the token limit per expected campaign (thinking tokens included).
+GEMINI_OUTPUT_TOKENS_PER_CAMPAIGN = int(os.environ.get("GEMINI_OUTPUT_TOKENS_PER_CAMPAIGN", 300))
+
+# Persistent cache of campaign suggestions (see services/cache_service.py).
+SUGGESTION_CACHE_PATH = os.environ.get("SUGGESTION_CACHE_PATH", ".cache/suggestions.sqlite")
+SUGGESTION_CACHE_TTL_SECONDS = int(os.environ.get("SUGGESTION_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+SUGGESTION_CACHE_MAX_BYTES = int(os.environ.get("SUGGESTION_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+
+# Prompt encoding and budget of a single Gemini request, in estimated tokens
+# (see services/prompt_encoding.py).
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 12000))
+# Send multi-row requests in the columnar {"cols": [...], "rows": [[...]]} form.
+PROMPT_TABULAR = os.environ.get("PROMPT_TABULAR", "true").lower() == "true"
+
+# Background generation jobs of the UI (see services/job_queue.py).
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 3600))
+
+# Sharded generation over a shared work queue (see services/shard_service.py).
+SHARD_LEASE_BATCH = int(os.environ.get("SHARD_LEASE_BATCH", 20))
+SHARD_VISIBILITY_TIMEOUT_SECONDS = float(os.environ.get("SHARD_VISIBILITY_TIMEOUT_SECONDS", 300))
+SHARD_MAX_ATTEMPTS = int(os.environ.get("SHARD_MAX_ATTEMPTS", 3))
+
+# Versioned store of the generated campaigns (see services/result_store.py).
+RESULT_STORE_PATH = os.environ.get("RESULT_STORE_PATH", "results/campaign_results.sqlite")
+
+# Hot-path instrumentation (see services/metrics.py).
+# Comma-separated sinks of every span: "log", "jsonl" (empty keeps them in memory only).
+METRICS_SINKS = os.environ.get("METRICS_SINKS", "")
+METRICS_JSONL_PATH = os.environ.get("METRICS_JSONL_PATH", "results/metrics.jsonl")
+# Port of the Prometheus text endpoint (/metrics); 0 disables it.
+METRICS_PROMETHEUS_PORT = int(os.environ.get("METRICS_PROMETHEUS_PORT", 0))
+# Recent durations kept per stage for the p50/p95 of the sidebar panel.
+METRICS_WINDOW = int(os.environ.get("METRICS_WINDOW", 500))
+
+# Local Parquet snapshot of the cluster table (see services/snapshot_service.py).
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", ".cache/snapshot")
+# Column with the last change time of each row; empty means full reloads only.
+SNAPSHOT_WATERMARK_COLUMN = os.environ.get("SNAPSHOT_WATERMARK_COLUMN", "")
+SNAPSHOT_REFRESH_SECONDS = int(os.environ.get("SNAPSHOT_REFRESH_SECONDS", 600))
+
 # --------------------------------------------------------------------------
 # Support Functions
 # --------------------------------------------------------------------------
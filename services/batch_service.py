@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch pipeline: generates a campaign for every cluster without the UI.
+
+Clusters are streamed from BigQuery (or a local .jsonl/.csv/.parquet file), sent to
+suggest_campaign_from_cluster through the concurrent runner and written
+incrementally. Every finished cluster_id is checkpointed, so an interrupted run
+resumes without paying again for the work already done.
+
+Usage:
+  python -m services.batch_service --table PROJECT.DATASET.TABLE --output campaigns.jsonl
+  python -m services.batch_service --input clusters.parquet --output campaigns/ --format parquet
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Set
+
+from config.settings import (
+    CLUSTER_COLUMNS, GEMINI_CONCURRENCY, GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE, MODEL_GEMINI,
+    MODEL_GEMINI_FAST, MODEL_ROUTING, get_api_key,
+)
+from services import gemini_service
+from services.gemini_runner import ClusterResult, iter_results
+from services.rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------
+# 1) Sources
+# ------------------------------
+def iter_table_rows(table: str, filter_state: Optional[dict] = None, page_size: int = 10_000) -> Iterator[dict]:
+    """
+    Streams the clusters of a `project.dataset.table` from BigQuery.
+    """
+    from services.bq_service import iter_marketing_cluster_batches
+
+    project, dataset, table_id = table.split(".")
+    for batch in iter_marketing_cluster_batches(project, dataset, table_id, filter_state=filter_state,
+                                                columns=CLUSTER_COLUMNS, page_size=page_size):
+        yield from batch.to_pylist()
+
+
+def iter_file_rows(path: str) -> Iterator[dict]:
+    """
+    Streams the clusters of a local .jsonl, .csv or .parquet file.
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    elif path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# ------------------------------
+# 2) Checkpoint and writers
+# ------------------------------
+class Checkpoint:
+    """
+    Append-only file with one finished cluster_id per line.
+
+    An id is only appended after its result has been written, so a crash can at
+    worst regenerate the clusters that were in flight.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        self._file = open(path, "a", encoding="utf-8")
+
+    def add(self, cluster_id: str):
+        self._file.write(f"{cluster_id}\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.done.add(cluster_id)
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter:
+    """
+    Appends one JSON record per line, flushed to disk after every record.
+    """
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    Buffers records and writes them as part files of a Parquet dataset directory.
+
+    The checkpoint of a record is only written after its part file, see
+    `pending_ids`.
+    """
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._buffer: List[dict] = []
+
+    @property
+    def pending_ids(self) -> List[str]:
+        return [record["cluster_id"] for record in self._buffer]
+
+    def write(self, record: dict):
+        self._buffer.append({**record, "suggestion": json.dumps(record["suggestion"], ensure_ascii=False)})
+
+    def flush(self):
+        if not self._buffer:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        name = f"part-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}.parquet"
+        tmp_path = os.path.join(self.directory, f".{name}.tmp")
+        pq.write_table(pa.Table.from_pylist(self._buffer), tmp_path)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+
+
+# ------------------------------
+# 3) Pipeline
+# ------------------------------
+def _chunks(rows: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _run_chunk(rows: List[dict], call, on_result, limits: dict):
+    async for outcome in iter_results(rows, call, **limits):
+        on_result(outcome)
+
+
+def run_batch(rows: Iterator[dict], user_notes: str, api_key: str, output: str, fmt: str = "jsonl",
+              checkpoint_path: Optional[str] = None, chunk_size: int = 500, model=None,
+              model_name: str = MODEL_GEMINI, cache=None, store=None, routing: bool = False,
+              **limits) -> Dict[str, float]:
+    """
+    Generates and stores a campaign for every cluster not yet checkpointed.
+
+    Args:
+      rows (Iterator[dict]): Cluster dictionaries, each with a 'cluster_id'.
+      user_notes (str): Campaign objective shared by every cluster.
+      api_key (str): The Gemini API key for authentication.
+      output (str): JSONL file, or directory of Parquet part files.
+      fmt (str): "jsonl" or "parquet".
+      checkpoint_path (str): File of finished cluster_ids. Defaults to `<output>.checkpoint`.
+      chunk_size (int): Clusters read from the source per round of the runner.
+      model: Optional model (e.g. a FakeGenerativeModel).
+      model_name (str): Gemini model, when `model` is omitted.
+      cache: Optional SuggestionCache.
+      store: Optional ResultStore, which also keeps every generated campaign.
+      routing (bool): Try MODEL_GEMINI_FAST first and escalate failures to `model_name`.
+      **limits: Forwarded to the concurrent runner (concurrency, requests_per_minute...).
+
+    Returns:
+      Dict[str, float]: Throughput report of the run.
+    """
+    checkpoint = Checkpoint(checkpoint_path or f"{output.rstrip('/')}.checkpoint")
+    writer = ParquetWriter(output) if fmt == "parquet" else JsonlWriter(output)
+    report = {"done": 0, "failed": 0, "skipped": 0}
+    tokens_before = gemini_service.usage.total_tokens
+    routed_before = (gemini_service.routing_stats.requests, gemini_service.routing_stats.escalations)
+    started_at = time.perf_counter()
+    # One budget for the whole run: each chunk runs on a new event loop, and new
+    # buckets would start full at every chunk boundary
+    limits["limiter"] = limits.get("limiter") or RateLimiter(
+        limits.pop("requests_per_minute", GEMINI_REQUESTS_PER_MINUTE),
+        limits.pop("tokens_per_minute", GEMINI_TOKENS_PER_MINUTE),
+    )
+
+    def on_result(outcome: ClusterResult):
+        if not outcome.ok:
+            report["failed"] += 1
+            return
+        # With routing, the model is the tier that answered
+        suggestion = dict(outcome.result)
+        writer.write({
+            "cluster_id": outcome.cluster_id,
+            "model": suggestion.pop("model", model_name),
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "suggestion": suggestion,
+        })
+        report["done"] += 1
+        if fmt == "jsonl":
+            checkpoint.add(outcome.cluster_id)
+
+    def call(row: dict) -> dict:
+        if routing:
+            tiers = [gemini_service.Tier(MODEL_GEMINI_FAST, gemini_service.MODEL_GEMINI_FAST_MAX_REPAIRS),
+                     gemini_service.Tier(model_name)]
+            models = {tier.model_name: model for tier in tiers} if model is not None else None
+            return gemini_service.route_campaign_from_cluster(
+                row, user_notes, api_key=api_key, tiers=tiers, models=models, cache=cache, store=store
+            )
+        return gemini_service.suggest_campaign_from_cluster(
+            row, user_notes, api_key=api_key, model=model, cache=cache, model_name=model_name, store=store
+        )
+
+    try:
+        for chunk in _chunks(rows, chunk_size):
+            todo = [row for row in chunk if str(row["cluster_id"]) not in checkpoint.done]
+            report["skipped"] += len(chunk) - len(todo)
+            if not todo:
+                continue
+            asyncio.run(_run_chunk(todo, call, on_result, limits))
+            if fmt == "parquet":
+                pending = writer.pending_ids
+                writer.flush()
+                for cluster_id in pending:
+                    checkpoint.add(cluster_id)
+            logger.info(f"Lote concluído: {report['done']} gerados, {report['failed']} falhas, {report['skipped']} já prontos.")
+    finally:
+        writer.close()
+        checkpoint.close()
+
+    elapsed = time.perf_counter() - started_at
+    tokens = gemini_service.usage.total_tokens - tokens_before
+    report.update({
+        "elapsed_s": round(elapsed, 2),
+        "clusters_per_s": round(report["done"] / elapsed, 3) if elapsed else 0.0,
+        "tokens": tokens,
+        "tokens_per_s": round(tokens / elapsed, 1) if elapsed else 0.0,
+    })
+    if routing:
+        routed = gemini_service.routing_stats.requests - routed_before[0]
+        escalated = gemini_service.routing_stats.escalations - routed_before[1]
+        report["escalation_rate"] = round(escalated / routed, 3) if routed else 0.0
+    return report
+
+
+def _parse_bool(value: str) -> bool:
+    if value.strip().lower() in ("true", "1", "sim", "yes"):
+        return True
+    if value.strip().lower() in ("false", "0", "nao", "não", "no"):
+        return False
+    raise ValueError(f"Valor booleano inválido: {value!r}")
+
+
+# Filter columns that are not STRING in the table: column -> parser of the CLI value.
+FILTER_TYPES = {
+    "age": int,
+    "is_subscriber": _parse_bool,
+}
+
+
+def _parse_filters(values: List[str]) -> dict:
+    # --filter content_interest=esportes,noticias --filter age=18,19 --filter is_subscriber=false
+    filter_state = {}
+    for value in values or []:
+        column, _, options = value.partition("=")
+        parse = FILTER_TYPES.get(column, str)
+        filter_state[column] = [parse(option) for option in options.split(",")]
+    return filter_state
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--table", help="BigQuery table as PROJECT.DATASET.TABLE")
+    source.add_argument("--input", help="local .jsonl, .csv or .parquet file")
+    parser.add_argument("--filter", action="append", help="COLUMN=V1,V2 (BigQuery source only)")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--checkpoint", help="defaults to <output>.checkpoint")
+    parser.add_argument("--notes", default="", help="business/campaign objective")
+    parser.add_argument("--model", default=MODEL_GEMINI)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=GEMINI_CONCURRENCY)
+    parser.add_argument("--rpm", type=int, default=GEMINI_REQUESTS_PER_MINUTE)
+    parser.add_argument("--use-cache", action="store_true", help="reuse the persistent suggestion cache")
+    parser.add_argument("--store", action="store_true", help="also keep the campaigns in the result store")
+    parser.add_argument("--routing", action=argparse.BooleanOptionalAction, default=MODEL_ROUTING,
+                        help=f"try {MODEL_GEMINI_FAST} first and escalate failures to --model")
+    parser.add_argument("--fake-model", action="store_true", help="use the local fake model (dry run)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    api_key = get_api_key()
+    model = None
+    if args.fake_model:
+        from services.fake_gemini import FakeGenerativeModel
+        model = FakeGenerativeModel()
+    elif not api_key:
+        parser.error("GEMINI_API_KEY não encontrada.")
+
+    cache = None
+    if args.use_cache:
+        from services.cache_service import get_default_cache
+        cache = get_default_cache()
+
+    store = None
+    if args.store:
+        from services.result_store import get_default_store
+        store = get_default_store()
+
+    rows = iter_table_rows(args.table, _parse_filters(args.filter)) if args.table else iter_file_rows(args.input)
+    report = run_batch(
+        rows, args.notes, api_key, args.output, fmt=args.format, checkpoint_path=args.checkpoint,
+        chunk_size=args.chunk_size, model=model, model_name=args.model, cache=cache, store=store, routing=args.routing,
+        concurrency=args.concurrency, requests_per_minute=args.rpm,
+    )
+    print(json.dumps(report, indent=2))
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
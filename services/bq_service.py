@@ -1,21 +1,273 @@
+from __future__ import annotations
+
+import logging
 import os
-from google.cloud import bigquery
-from google.oauth2 import service_account
-import streamlit as st
+import re
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from services.metrics import get_default_metrics
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+    from google.cloud import bigquery
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# Client
+# --------------------------------------------------------------------------
+
+# The BigQuery SDK and the credentials are only loaded on the first query,
+# so importing this module stays cheap (UI cold start, headless jobs).
+_client = None
+_client_lock = threading.Lock()
+_credentials = None
+_credentials_loaded = False
+
+
+def get_credentials():
+    """
+    Returns the service account credentials of GOOGLE_APPLICATION_CREDENTIALS,
+    loaded once, or None to let the clients find the credentials automatically.
+    """
+    global _credentials, _credentials_loaded
+    with _client_lock:
+        if not _credentials_loaded:
+            # The path is read from the GOOGLE_APPLICATION_CREDENTIALS environment variable
+            credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+
+            if credentials_path:
+                # If the variable is set, use the path to the credentials
+                from google.oauth2 import service_account
+                _credentials = service_account.Credentials.from_service_account_file(credentials_path)
+            # If not, the clients will try to find the credentials automatically.
+            # This may work if gcloud auth login was used.
+            _credentials_loaded = True
+        return _credentials
+
+
+def get_client():
+    """
+    Returns the process-wide BigQuery client, creating it on first use.
+    """
+    global _client
+    credentials = get_credentials()
+    with _client_lock:
+        if _client is None:
+            from google.cloud import bigquery
+            _client = bigquery.Client(credentials=credentials)
+        return _client
+
+
+def set_client(client):
+    """
+    Replaces the process-wide client (e.g. with a fake in tests). None resets it.
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def _report_error(message: str):
+    # Shown in the page when running under Streamlit, logged otherwise (batch jobs)
+    logger.error(message)
+    try:
+        from streamlit.runtime import exists as in_streamlit
+        if in_streamlit():
+            import streamlit as st
+            st.error(message)
+    except ImportError:
+        pass
+
+# --------------------------------------------------------------------------
+# Query builder
+# --------------------------------------------------------------------------
+
+# The UI filters locally, over the snapshot (services/snapshot_service.py and
+# services/filter_index.py); these filters are pushed down to BigQuery for the
+# batch and shard jobs (--filter), which read the table directly.
+
+# Multiselect filters of the UI: filter_state key -> column (values go to IN UNNEST).
+LIST_FILTERS = {
+    "content_interest": "content_interest",
+    "location": "location",
+    "previous_engagement": "previous_engagement",
+    "is_subscriber": "is_subscriber",
+    "device_type": "device_type",
+    "age": "age",
+}
+
+# Range filters of the UI: filter_state key -> column (values are a (min, max) pair).
+RANGE_FILTERS = {
+    "access_time_range": "access_time",
+    "daily_minutes_range": "avg_daily_minutes",
+}
+
+# Low-cardinality columns returned as dictionary-encoded (categorical) columns.
+CATEGORICAL_COLUMNS = ["content_interest", "location", "device_type", "previous_engagement"]
 
-# The path is read from the GOOGLE_APPLICATION_CREDENTIALS environment variable
-credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_TABLE_PART = re.compile(r"^[A-Za-z0-9_\-]+$")
 
-if credentials_path:
-    # If the variable is set, use the path to the credentials
-    credentials = service_account.Credentials.from_service_account_file(credentials_path)
-    client = bigquery.Client(credentials=credentials)
-else:
-    # If not, the client will try to find the credentials automatically.
-    # This may work if gcloud auth login was used.
-    client = bigquery.Client()
 
-def get_marketing_clusters(table_project_id: str, dataset_id: str, table_id: str):
+@dataclass
+class QueryParam:
+    """
+    A BigQuery query parameter, kept independent of the client library so the
+    generated SQL can be checked without BigQuery.
+    """
+    name: str
+    type: str
+    value: Any
+    is_array: bool = False
+
+    def to_bigquery(self):
+        from google.cloud import bigquery
+
+        if self.is_array:
+            return bigquery.ArrayQueryParameter(self.name, self.type, list(self.value))
+        return bigquery.ScalarQueryParameter(self.name, self.type, self.value)
+
+
+def _check_identifier(name: str) -> str:
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Nome de coluna inválido: {name!r}")
+    return name
+
+
+def table_ref(table_project_id: str, dataset_id: str, table_id: str) -> str:
+    """
+    Returns the quoted `project.dataset.table` reference, rejecting unsafe names.
+    """
+    for part in (table_project_id, dataset_id, table_id):
+        if not _TABLE_PART.match(part):
+            raise ValueError(f"Identificador de tabela inválido: {part!r}")
+    return f"`{table_project_id}.{dataset_id}.{table_id}`"
+
+
+def _to_python(value: Any) -> Any:
+    # numpy/pandas scalars (e.g. values taken from a DataFrame) expose .item()
+    return value.item() if hasattr(value, "item") and not isinstance(value, (str, bytes)) else value
+
+
+def _param_type(value: Any) -> str:
+    # bool must come before int, since bool is a subclass of int
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, int):
+        return "INT64"
+    if isinstance(value, float):
+        return "FLOAT64"
+    if isinstance(value, datetime):
+        return "TIMESTAMP"
+    if isinstance(value, date):
+        return "DATE"
+    if isinstance(value, time):
+        return "TIME"
+    return "STRING"
+
+
+def build_clusters_query(table: str, filter_state: Optional[Dict[str, Any]] = None,
+                         columns: Optional[Sequence[str]] = None, limit: Optional[int] = None,
+                         offset: Optional[int] = None,
+                         after_cluster_id: Optional[Any] = None,
+                         changed_since: Optional[Tuple[str, Any]] = None) -> Tuple[str, List[QueryParam]]:
+    """
+    Builds the parameterized query of the cluster table.
+
+    Args:
+        table: Quoted table reference, as returned by table_ref.
+        filter_state: The UI filters. Empty lists and None ranges are ignored.
+        columns: Columns to select. None selects every column.
+        limit: Maximum number of rows.
+        offset: Rows to skip (LIMIT/OFFSET paging).
+        after_cluster_id: Last cluster_id of the previous page (keyset paging).
+        changed_since: (column, watermark) pair; only rows with column > watermark are read.
+
+    Returns:
+        The SQL and its parameters.
+    """
+    filter_state = filter_state or {}
+    select = ", ".join(_check_identifier(c) for c in columns) if columns else "*"
+    predicates, params = [], []
+
+    for key, column in LIST_FILTERS.items():
+        values = [_to_python(v) for v in filter_state.get(key) or []]
+        if values:
+            params.append(QueryParam(key, _param_type(values[0]), values, is_array=True))
+            predicates.append(f"{_check_identifier(column)} IN UNNEST(@{key})")
+
+    for key, column in RANGE_FILTERS.items():
+        bounds = filter_state.get(key)
+        if bounds:
+            low, high = map(_to_python, bounds)
+            params.append(QueryParam(f"{key}_min", _param_type(low), low))
+            params.append(QueryParam(f"{key}_max", _param_type(high), high))
+            predicates.append(f"{_check_identifier(column)} BETWEEN @{key}_min AND @{key}_max")
+
+    if after_cluster_id is not None:
+        after_cluster_id = _to_python(after_cluster_id)
+        params.append(QueryParam("after_cluster_id", _param_type(after_cluster_id), after_cluster_id))
+        predicates.append("cluster_id > @after_cluster_id")
+
+    if changed_since is not None:
+        column, watermark = changed_since[0], _to_python(changed_since[1])
+        params.append(QueryParam("watermark", _param_type(watermark), watermark))
+        predicates.append(f"{_check_identifier(column)} > @watermark")
+
+    query = f"SELECT {select}\nFROM {table}"
+    if predicates:
+        query += "\nWHERE " + "\n  AND ".join(predicates)
+    query += "\nORDER BY cluster_id"
+    if limit is not None:
+        query += f"\nLIMIT {int(limit)}"
+        if offset:
+            query += f" OFFSET {int(offset)}"
+    return query, params
+
+
+# --------------------------------------------------------------------------
+# Queries
+# --------------------------------------------------------------------------
+
+def _query_clusters(table_project_id: str, dataset_id: str, table_id: str, filter_state=None, columns=None,
+                    limit=None, offset=None, after_cluster_id=None, changed_since=None) -> bigquery.QueryJob:
+    from google.cloud import bigquery
+
+    query, params = build_clusters_query(
+        table_ref(table_project_id, dataset_id, table_id),
+        filter_state, columns, limit, offset, after_cluster_id, changed_since
+    )
+    job_config = bigquery.QueryJobConfig(query_parameters=[p.to_bigquery() for p in params])
+    return get_client().query(query, job_config=job_config)
+
+
+def _bqstorage_client(credentials=None):
+    # Optional dependency: google-cloud-bigquery-storage (Storage Read API)
+    from google.cloud import bigquery_storage
+    return bigquery_storage.BigQueryReadClient(credentials=credentials)
+
+
+def _dictionary_encode(table: pa.Table, columns: Sequence[str] = CATEGORICAL_COLUMNS) -> pa.Table:
+    """
+    Dictionary-encodes the low-cardinality columns (pandas reads them as categoricals).
+    """
+    import pyarrow as pa
+
+    for name in columns:
+        index = table.schema.get_field_index(name)
+        if index >= 0 and not pa.types.is_dictionary(table.schema.field(index).type):
+            table = table.set_column(index, name, table.column(index).dictionary_encode())
+    return table
+
+
+def get_marketing_clusters(table_project_id: str, dataset_id: str, table_id: str,
+                           filter_state: Optional[Dict[str, Any]] = None,
+                           columns: Optional[Sequence[str]] = None, limit: Optional[int] = None,
+                           offset: Optional[int] = None, after_cluster_id: Optional[Any] = None):
     """
     Gets the list of clusters from a specific table in BigQuery.
 
@@ -23,23 +275,132 @@ def get_marketing_clusters(table_project_id: str, dataset_id: str, table_id: str
         table_project_id: ID of the project in Google Cloud.
         dataset_id: ID of the dataset in BigQuery.
         table_id: ID of the table containing the clusters column.
+        filter_state: The UI filters, pushed down as WHERE predicates.
+        columns: Columns to select. None selects every column.
+        limit: Maximum number of rows.
+        offset: Rows to skip (LIMIT/OFFSET paging).
+        after_cluster_id: Last cluster_id of the previous page (keyset paging).
 
     Returns:
-        A list of strings with the cluster names, or an empty list in case of error.
+        A list of dictionaries, one per cluster, or an empty list in case of error.
     """
     try:
-        query = f"""
-            SELECT *
-            FROM `{table_project_id}.{dataset_id}.{table_id}`
-            ORDER BY cluster_id
-        """
-        query_job = client.query(query)
-        
-        # Converte cada linha do resultado em um dicionário para garantir o tipo de dado correto
-        rows = [dict(row) for row in query_job.result()]
+        with get_default_metrics().span("bigquery", query="clusters") as span:
+            query_job = _query_clusters(
+                table_project_id, dataset_id, table_id,
+                filter_state, columns, limit, offset, after_cluster_id
+            )
+
+            # Converte cada linha do resultado em um dicionário para garantir o tipo de dado correto
+            rows = [dict(row) for row in query_job.result()]
+            span["rows"] = len(rows)
+            span["bytes_processed"] = getattr(query_job, "total_bytes_processed", None) or 0
         return rows
 
     except Exception as e:
-        st.error(f"Erro ao buscar clusters do BigQuery: {e}")
+        _report_error(f"Erro ao buscar clusters do BigQuery: {e}")
         # Retorna uma lista vazia em caso de erro
-        return []
\ No newline at end of file
+        return []
+
+
+def get_table_columns(table_project_id: str, dataset_id: str, table_id: str) -> List[str]:
+    """
+    Gets the column names of a table from its metadata (no query is run).
+
+    Returns:
+        The column names, or an empty list in case of error.
+    """
+    try:
+        table = get_client().get_table(f"{table_project_id}.{dataset_id}.{table_id}")
+        return [field.name for field in table.schema]
+
+    except Exception as e:
+        _report_error(f"Erro ao ler o esquema da tabela do BigQuery: {e}")
+        return []
+
+
+def get_marketing_clusters_arrow(table_project_id: str, dataset_id: str, table_id: str,
+                                 filter_state: Optional[Dict[str, Any]] = None,
+                                 columns: Optional[Sequence[str]] = None, limit: Optional[int] = None,
+                                 use_storage_api: bool = False,
+                                 changed_since: Optional[Tuple[str, Any]] = None,
+                                 raise_errors: bool = False) -> pa.Table:
+    """
+    Gets the clusters as a columnar Arrow table, without building a Python object per row.
+
+    Args:
+        table_project_id: ID of the project in Google Cloud.
+        dataset_id: ID of the dataset in BigQuery.
+        table_id: ID of the table containing the clusters column.
+        filter_state: The UI filters, pushed down as WHERE predicates.
+        columns: Columns to select. None selects every column.
+        limit: Maximum number of rows.
+        use_storage_api: Download the result through the BigQuery Storage Read API.
+        changed_since: (column, watermark) pair; only rows with column > watermark are read.
+        raise_errors: Raise the error instead of reporting it and returning an empty
+            table, so that callers can tell a failure from an empty result.
+
+    Returns:
+        An Arrow table with CATEGORICAL_COLUMNS dictionary-encoded, or an empty
+        table in case of error.
+    """
+    try:
+        with get_default_metrics().span("bigquery", query="clusters_arrow") as span:
+            query_job = _query_clusters(table_project_id, dataset_id, table_id, filter_state, columns, limit,
+                                        changed_since=changed_since)
+            table = query_job.to_arrow(create_bqstorage_client=use_storage_api)
+            span["rows"] = table.num_rows
+            span["bytes_processed"] = getattr(query_job, "total_bytes_processed", None) or 0
+        return _dictionary_encode(table)
+
+    except Exception as e:
+        if raise_errors:
+            raise
+        _report_error(f"Erro ao buscar clusters do BigQuery: {e}")
+        import pyarrow as pa
+        return pa.table({})
+
+
+def get_marketing_clusters_df(table_project_id: str, dataset_id: str, table_id: str,
+                              filter_state: Optional[Dict[str, Any]] = None,
+                              columns: Optional[Sequence[str]] = None, limit: Optional[int] = None,
+                              use_storage_api: bool = False):
+    """
+    Gets the clusters as a pandas DataFrame built directly from the Arrow result.
+
+    Low-cardinality columns come back with the `category` dtype. See
+    get_marketing_clusters_arrow for the arguments.
+
+    Returns:
+        A DataFrame, empty in case of error.
+    """
+    return get_marketing_clusters_arrow(
+        table_project_id, dataset_id, table_id, filter_state, columns, limit, use_storage_api
+    ).to_pandas()
+
+
+def iter_marketing_cluster_batches(table_project_id: str, dataset_id: str, table_id: str,
+                                   filter_state: Optional[Dict[str, Any]] = None,
+                                   columns: Optional[Sequence[str]] = None, page_size: int = 50_000,
+                                   use_storage_api: bool = False) -> Iterator[pa.RecordBatch]:
+    """
+    Streams the clusters as Arrow record batches, for tables that don't fit in memory.
+
+    Unlike the other queries, errors are raised to the caller, since a partial
+    stream can't be told apart from a complete one.
+
+    Args:
+        page_size: Rows per page when reading through the REST API.
+        use_storage_api: Stream through the BigQuery Storage Read API.
+        See get_marketing_clusters_arrow for the other arguments.
+
+    Yields:
+        Arrow record batches with CATEGORICAL_COLUMNS dictionary-encoded.
+    """
+    import pyarrow as pa
+
+    query_job = _query_clusters(table_project_id, dataset_id, table_id, filter_state, columns)
+    rows = query_job.result(page_size=page_size)
+    bqstorage_client = _bqstorage_client(get_credentials()) if use_storage_api else None
+    for batch in rows.to_arrow_iterable(bqstorage_client=bqstorage_client):
+        yield from _dictionary_encode(pa.Table.from_batches([batch])).to_batches()
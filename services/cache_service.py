@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent, content-addressed cache for campaign suggestions.
+Entries live in a SQLite file, keyed by a stable hash of everything that shapes
+the answer, with TTL and LRU eviction under a size cap.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from config.settings import SUGGESTION_CACHE_MAX_BYTES, SUGGESTION_CACHE_PATH, SUGGESTION_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(cluster_dict: dict, user_notes: str, model_name: str, system_instruction: str) -> str:
+    """
+    Builds a stable key for a suggestion request.
+
+    The cluster is canonicalized (sorted keys, compact separators) so that the same
+    data always hashes the same regardless of column order.
+
+    Args:
+      cluster_dict (dict): Dictionary with cluster information.
+      user_notes (str): Additional user notes about the campaign objective.
+      model_name (str): Name of the model that generates the suggestion.
+      system_instruction (str): The fixed rules sent with the prompt.
+
+    Returns:
+      str: Hex SHA-256 of the request.
+    """
+    canonical = json.dumps(
+        {
+            "cluster": cluster_dict,
+            "notes": user_notes or "",
+            "model": model_name,
+            "system": _sha256(system_instruction),
+        },
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str,
+    )
+    return _sha256(canonical)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    # Generation latency avoided by the hits, using the latency stored with each entry.
+    saved_latency_s: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SuggestionCache:
+    """
+    SQLite-backed cache with TTL and LRU eviction.
+
+    Args:
+      path (str): SQLite file. ":memory:" keeps the cache in the process only.
+      ttl_seconds (float): Entries older than this are treated as missing.
+      max_bytes (int): Total size of the stored values; least recently used
+        entries are evicted above it.
+    """
+    def __init__(self, path: str = SUGGESTION_CACHE_PATH, ttl_seconds: float = SUGGESTION_CACHE_TTL_SECONDS,
+                 max_bytes: int = SUGGESTION_CACHE_MAX_BYTES):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS suggestions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                latency_s REAL NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_suggestions_accessed_at ON suggestions (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached value, or None on a miss or an expired entry.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, latency_s, created_at FROM suggestions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[2] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM suggestions WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.stats.misses += 1
+                return None
+            self._conn.execute("UPDATE suggestions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.stats.hits += 1
+            self.stats.saved_latency_s += row[1]
+            return row[0]
+
+    def set(self, key: str, value: str, latency_s: float = 0.0):
+        """
+        Stores a value and evicts least recently used entries above the size cap.
+
+        Args:
+          key (str): Key built by make_cache_key.
+          value (str): The suggestion, serialized.
+          latency_s (float): How long it took to generate, used in the stats.
+        """
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO suggestions VALUES (?, ?, ?, ?, ?, ?)",
+                (key, value, size, latency_s, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM suggestions WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM suggestions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM suggestions ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM suggestions WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.info(f"Cache de sugestões: {evicted} entradas removidas (LRU).")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM suggestions")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM suggestions").fetchone()[0]
+
+
+_default_cache: Optional[SuggestionCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> SuggestionCache:
+    """
+    Returns the process-wide cache stored at SUGGESTION_CACHE_PATH.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SuggestionCache()
+        return _default_cache
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Duplicate-profile detection for campaign generation.
+Clusters with the same feature signature get the same campaign, so only one
+representative per group is sent to Gemini and the result is fanned out.
+"""
+import bisect
+import logging
+import math
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Fields the prompt rules in SYSTEM_INSTRUCTION depend on. The send time also
+# uses the peak hour of 'access_time', so each member gets its own rule-based
+# 'horario' (see `overrides` in suggest_with_dedup).
+DEFAULT_SIGNATURE_COLUMNS = [
+    "content_interest", "age", "device_type", "previous_engagement", "is_subscriber", "location",
+]
+
+# A bucket is either a width (value -> floor(value / width)) or a sorted list of
+# band edges (value -> index of its band).
+Bucket = Union[float, Sequence[float]]
+
+# The tone rules only distinguish these age bands: 18–24, 25–44, 45–64, 65+.
+AGE_BANDS = [25, 45, 65]
+
+DEFAULT_BUCKETS: Dict[str, Bucket] = {
+    "age": AGE_BANDS,
+    "avg_daily_minutes": 30,
+    "last_access": 7,
+}
+
+
+def _bucket(value: Any, bucket: Bucket) -> Any:
+    if isinstance(value, datetime):
+        # timestamps (e.g. raw 'last_access') are bucketed as days ago
+        value = (datetime.now(timezone.utc) - value).days
+    elif hasattr(value, "hour") and hasattr(value, "minute"):
+        # time of day (e.g. 'access_time') is bucketed as hours
+        value = value.hour + value.minute / 60
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    if math.isnan(number):
+        return None
+    if isinstance(bucket, (int, float)):
+        return math.floor(number / bucket)
+    return bisect.bisect_right(list(bucket), number)
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def feature_signature(row: dict, columns: Sequence[str] = DEFAULT_SIGNATURE_COLUMNS,
+                      buckets: Optional[Dict[str, Bucket]] = None) -> Tuple:
+    """
+    Returns the canonical signature of a cluster: its normalized, bucketed features.
+
+    Args:
+      row (dict): Cluster dictionary.
+      columns (Sequence[str]): Features that make two clusters equivalent.
+      buckets (dict): Bucket of each continuous column. Defaults to DEFAULT_BUCKETS.
+
+    Returns:
+      Tuple: Hashable signature, in the order of `columns`.
+    """
+    buckets = DEFAULT_BUCKETS if buckets is None else buckets
+    signature = []
+    for column in columns:
+        value = _normalize(row.get(column))
+        if column in buckets and value is not None:
+            value = _bucket(value, buckets[column])
+        signature.append(value)
+    return tuple(signature)
+
+
+@dataclass
+class DedupGroup:
+    signature: Tuple
+    representative: dict
+    members: List[str] = field(default_factory=list)
+
+
+@dataclass
+class DedupReport:
+    clusters: int
+    groups: int
+
+    @property
+    def ratio(self) -> float:
+        """
+        Clusters per group (e.g. 10.0 means a tenth of the clusters is sent to the LLM).
+        Requests carry several clusters each, so the saving in calls is smaller.
+        """
+        return self.clusters / self.groups if self.groups else 0.0
+
+    @property
+    def calls_saved(self) -> int:
+        return self.clusters - self.groups
+
+
+def group_clusters(rows: List[dict], columns: Sequence[str] = DEFAULT_SIGNATURE_COLUMNS,
+                   buckets: Optional[Dict[str, Bucket]] = None) -> List[DedupGroup]:
+    """
+    Groups clusters by feature signature. The first cluster of a group represents it.
+    """
+    groups: Dict[Tuple, DedupGroup] = {}
+    for row in rows:
+        signature = feature_signature(row, columns, buckets)
+        group = groups.get(signature)
+        if group is None:
+            group = groups[signature] = DedupGroup(signature, row)
+        group.members.append(str(row["cluster_id"]))
+    return list(groups.values())
+
+
+def suggest_with_dedup(rows: List[dict], user_notes: str, api_key: str,
+                       generate: Optional[Callable[[List[dict]], Dict[str, dict]]] = None,
+                       columns: Sequence[str] = DEFAULT_SIGNATURE_COLUMNS,
+                       buckets: Optional[Dict[str, Bucket]] = None,
+                       model=None,
+                       overrides: Optional[Dict[str, dict]] = None) -> Tuple[Dict[str, dict], DedupReport]:
+    """
+    Generates one campaign per group of equivalent clusters and fans it out.
+
+    Args:
+      rows (List[dict]): Cluster dictionaries, each with a 'cluster_id'.
+      user_notes (str): Additional user notes about the campaign objective.
+      api_key (str): The Gemini API key for authentication.
+      generate (Callable): Takes the representatives and returns their campaigns by
+        cluster_id. Defaults to suggest_campaigns_for_clusters.
+      columns (Sequence[str]): Features that make two clusters equivalent.
+      buckets (dict): Bucket of each continuous column. Defaults to DEFAULT_BUCKETS.
+      model: Optional model for the default `generate` (e.g. a fake).
+      overrides (Dict[str, dict]): Fields merged into the campaign of each member,
+        by cluster_id (e.g. its own 'horario' from services.rule_engine). With the
+        default `generate`, each member's rule-based 'horario' is used.
+
+    Returns:
+      The campaign of every cluster (keyed by cluster_id) and the dedup report.
+    """
+    if generate is None:
+        from services.gemini_service import suggest_campaigns_for_clusters
+        from services.rule_engine import rule_plan
+
+        def generate(representatives: List[dict]) -> Dict[str, dict]:
+            return suggest_campaigns_for_clusters(representatives, user_notes, api_key, model=model)
+
+        if overrides is None:
+            # access_time is not in the signature: the representative's send time
+            # does not fit members with another peak hour
+            overrides = {cluster_id: {"horario": fields["horario"]} for cluster_id, fields in rule_plan(rows).items()}
+
+    groups = group_clusters(rows, columns, buckets)
+    report = DedupReport(clusters=len(rows), groups=len(groups))
+    logger.info(f"Dedup: {report.clusters} clusters em {report.groups} grupos ({report.ratio:.1f} por grupo).")
+
+    generated = generate([group.representative for group in groups])
+
+    results: Dict[str, dict] = {}
+    for group in groups:
+        campaign = generated.get(str(group.representative["cluster_id"]))
+        if campaign is None:
+            continue
+        for cluster_id in group.members:
+            member_fields = overrides.get(cluster_id, {}) if overrides else {}
+            results[cluster_id] = {**campaign, **member_fields, "cluster_id": cluster_id}
+    return results, report
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the BigQuery client.
+It serves an in-memory Arrow table through the calls bq_service makes (query,
+result, to_arrow), applying the filters, watermark and LIMIT of the generated
+SQL, so the data paths can be exercised without network or credentials.
+Install it with `bq_service.set_client(FakeBigQueryClient(table))`.
+"""
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from services.bq_service import LIST_FILTERS, RANGE_FILTERS
+
+_SELECT_PATTERN = re.compile(r"SELECT\s+(.*?)\s+FROM", re.DOTALL)
+_LIMIT_PATTERN = re.compile(r"LIMIT\s+(\d+)(?:\s+OFFSET\s+(\d+))?")
+_WATERMARK_PATTERN = re.compile(r"(\w+)\s+>\s+@watermark")
+
+
+def _parameters(job_config) -> dict:
+    # ScalarQueryParameter has .value, ArrayQueryParameter has .values
+    return {
+        param.name: getattr(param, "values", getattr(param, "value", None))
+        for param in getattr(job_config, "query_parameters", None) or []
+    }
+
+
+class FakeRowIterator:
+    """
+    Mimics `bigquery.table.RowIterator`: iterates rows as dicts and streams Arrow batches.
+    """
+    def __init__(self, table: pa.Table, page_size: Optional[int] = None):
+        self._table = table
+        self._page_size = page_size or 50_000
+
+    @property
+    def total_rows(self) -> int:
+        return self._table.num_rows
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self._table.to_pylist())
+
+    def to_arrow_iterable(self, bqstorage_client=None) -> Iterator[pa.RecordBatch]:
+        yield from self._table.to_batches(max_chunksize=self._page_size)
+
+
+class FakeQueryJob:
+    """
+    Mimics `bigquery.QueryJob` for an already computed result.
+    """
+    def __init__(self, table: pa.Table, latency_s: float = 0.0):
+        self._table = table
+        self._latency_s = latency_s
+
+    @property
+    def total_bytes_processed(self) -> int:
+        return self._table.nbytes
+
+    def result(self, page_size: Optional[int] = None) -> FakeRowIterator:
+        time.sleep(self._latency_s)
+        return FakeRowIterator(self._table, page_size)
+
+    def to_arrow(self, create_bqstorage_client: bool = False) -> pa.Table:
+        time.sleep(self._latency_s)
+        return self._table
+
+
+class FakeBigQueryClient:
+    """
+    Answers the cluster queries of bq_service from `table`.
+
+    Args:
+      table (pa.Table): The rows of the cluster table.
+      latency_s (float): Fixed latency added to every query result.
+    """
+    def __init__(self, table: pa.Table, latency_s: float = 0.0):
+        self.table = table
+        self.latency_s = latency_s
+        self.queries: List[str] = []
+        self._lock = threading.Lock()
+
+    def get_table(self, table_ref: str) -> SimpleNamespace:
+        return SimpleNamespace(schema=[SimpleNamespace(name=name) for name in self.table.column_names])
+
+    def query(self, query: str, job_config=None) -> FakeQueryJob:
+        with self._lock:
+            self.queries.append(query)
+        return FakeQueryJob(self._select(query, _parameters(job_config)), self.latency_s)
+
+    def _select(self, query: str, params: dict) -> pa.Table:
+        table = self.table
+        mask = None
+
+        def combine(condition):
+            return condition if mask is None else pc.and_(mask, condition)
+
+        for key, column in LIST_FILTERS.items():
+            if key in params:
+                mask = combine(pc.is_in(table.column(column), value_set=pa.array(params[key])))
+        for key, column in RANGE_FILTERS.items():
+            if f"{key}_min" in params:
+                values = table.column(column)
+                mask = combine(pc.and_(pc.greater_equal(values, params[f"{key}_min"]),
+                                       pc.less_equal(values, params[f"{key}_max"])))
+        if "after_cluster_id" in params:
+            mask = combine(pc.greater(table.column("cluster_id"), params["after_cluster_id"]))
+        watermark = _WATERMARK_PATTERN.search(query)
+        if watermark and "watermark" in params:
+            mask = combine(pc.greater(table.column(watermark.group(1)), params["watermark"]))
+        if mask is not None:
+            table = table.filter(mask)
+
+        select = _SELECT_PATTERN.search(query).group(1).strip()
+        if select != "*":
+            table = table.select([column.strip() for column in select.split(",")])
+
+        limit = _LIMIT_PATTERN.search(query)
+        if limit:
+            table = table.slice(int(limit.group(2) or 0), int(limit.group(1)))
+        return table
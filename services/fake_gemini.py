@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Gemini model.
+It answers with the {"campanhas": [...]} contract, with configurable latency and
+error injection, so the services can be exercised without network or API key.
+"""
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+# The cluster payload follows one of these markers (batched and single prompts).
+_PAYLOAD_MARKERS = ("Entrada JSON:", "Cluster JSON:")
+# Fallback for other prompts: every cluster_id found gets one campaign.
+_CLUSTER_ID_PATTERN = re.compile(r'"cluster_id":\s*"?([^",}\s]+)"?')
+
+# Messages within the length limits of each channel.
+_MESSAGES = {
+    "Push": "Veja agora os melhores momentos da rodada ao vivo. 7 dias grátis, corre!",
+    "Email": "Melhores momentos da rodada: veja agora",
+}
+
+
+def _prompt_rows(prompt: str) -> List[dict]:
+    """
+    Reads the cluster rows of a prompt: {"rows": [...]}, the tabular
+    {"cols": [...], "rows": [[...]]} or a single cluster object.
+    """
+    decoder = json.JSONDecoder()
+    for marker in _PAYLOAD_MARKERS:
+        start = prompt.find(marker)
+        if start < 0:
+            continue
+        try:
+            payload, _ = decoder.raw_decode(prompt[start + len(marker):].lstrip())
+        except ValueError:
+            break
+        rows = payload.get("rows", [payload]) if isinstance(payload, dict) else []
+        if isinstance(payload, dict) and "cols" in payload:
+            rows = [dict(zip(payload["cols"], values)) for values in rows]
+        return [row for row in rows if isinstance(row, dict) and "cluster_id" in row]
+    return [{"cluster_id": cluster_id} for cluster_id in _CLUSTER_ID_PATTERN.findall(prompt)]
+
+
+class FakeAPIError(Exception):
+    """
+    Error raised by the fake model. `code` mimics the HTTP status of the real API.
+    """
+    def __init__(self, code: int, message: str = "fake error"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+@dataclass
+class FakeUsageMetadata:
+    prompt_token_count: int
+    candidates_token_count: int
+    total_token_count: int
+
+
+@dataclass
+class FakeResponse:
+    text: str
+    usage_metadata: FakeUsageMetadata
+
+
+class FakeGenerativeModel:
+    """
+    Mimics `genai.GenerativeModel.generate_content`.
+
+    Args:
+      latency_s (float): Fixed latency added to every call.
+      jitter_s (float): Random extra latency, uniform in [0, jitter_s].
+      error_rate (float): Probability of raising FakeAPIError on a call.
+      error_code (int): Status code of the injected errors (429, 500, 503...).
+      invalid_rate (float): Probability of each campaign breaking the contract
+        (unknown channel), to exercise the repair retries.
+      seed (int): Seed of the random generator, for reproducible runs.
+      model_name (str): Name reported like `genai.GenerativeModel.model_name`.
+      seconds_per_1k_tokens (float): Extra latency per thousand prompt tokens.
+      output_tokens (int): Output tokens reported per campaign. None estimates
+        them from the length of the response.
+    """
+    def __init__(self, latency_s: float = 0.0, jitter_s: float = 0.0, error_rate: float = 0.0,
+                 error_code: int = 429, invalid_rate: float = 0.0, seed: int = None,
+                 model_name: str = "fake", seconds_per_1k_tokens: float = 0.0,
+                 output_tokens: Optional[int] = None):
+        self.model_name = model_name
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.output_tokens = output_tokens
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.invalid_rate = invalid_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, generation_config=None, **kwargs) -> FakeResponse:
+        prompt = contents if isinstance(contents, str) else json.dumps(contents, default=str)
+        rows = _prompt_rows(prompt)
+        prompt_tokens = max(1, len(prompt) // 4)
+        with self._lock:
+            self.calls += 1
+            delay = (self.latency_s + self._random.uniform(0, self.jitter_s)
+                     + self.seconds_per_1k_tokens * prompt_tokens / 1000)
+            fail = self._random.random() < self.error_rate
+            invalid = [self._random.random() < self.invalid_rate for _ in range(len(rows) or 1)]
+
+        time.sleep(delay)
+        if fail:
+            raise FakeAPIError(self.error_code)
+
+        cluster_ids = list(dict.fromkeys(str(row["cluster_id"]) for row in rows)) or [None]
+        channels = {str(row["cluster_id"]): row["canal"] for row in rows if row.get("canal") in _MESSAGES}
+        campaigns = [
+            {
+                "cluster_id": cluster_id,
+                "mensagem": _MESSAGES[channels.get(cluster_id, "Push")],
+                "canal": "SMS" if position < len(invalid) and invalid[position] else channels.get(cluster_id, "Push"),
+                "horario": "20:45",
+                "oferta": "7 dias grátis do streaming esportivo",
+                "estimativa_engajamento": "2.5% (fake)",
+            }
+            for position, cluster_id in enumerate(cluster_ids)
+        ]
+        text = json.dumps({"campanhas": campaigns}, ensure_ascii=False)
+        output_tokens = (self.output_tokens * len(campaigns) if self.output_tokens is not None
+                         else max(1, len(text) // 4))
+        return FakeResponse(text, FakeUsageMetadata(prompt_tokens, output_tokens, prompt_tokens + output_tokens))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Bitmap index over the cluster DataFrame for the UI filters.
+It is built once per data snapshot and answers any combination of multiselect
+filters, option lists and per-option counts with bitwise operations.
+"""
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Number of set bits of every byte value, to count rows of a packed bitmap.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(bitmap: np.ndarray) -> int:
+    return int(_POPCOUNT[bitmap].sum(dtype=np.int64))
+
+
+class FilterIndex:
+    """
+    One packed bitmap per (column, value) of a DataFrame.
+
+    Within a column the selected values are OR-ed; across columns the results are
+    AND-ed, which matches the chained `isin` masks of the UI. Empty selections are
+    ignored. The DataFrame is kept as-is and never copied to answer a filter.
+
+    Args:
+      df (pd.DataFrame): The cluster data of the snapshot.
+      columns (Sequence[str]): Columns to index (the multiselect filters).
+    """
+    def __init__(self, df: pd.DataFrame, columns: Sequence[str]):
+        self.frame = df
+        self.columns = [c for c in columns if c in df.columns]
+        self.n_rows = len(df)
+        self._all = np.packbits(np.ones(self.n_rows, dtype=bool))
+        self._none = np.zeros_like(self._all)
+        self._bitmaps: Dict[str, Dict[Any, np.ndarray]] = {}
+
+        for column in self.columns:
+            # factorize keeps the order of first appearance, like unique(); NaN gets code -1
+            codes, uniques = pd.factorize(df[column])
+            self._bitmaps[column] = {
+                value: np.packbits(codes == code) for code, value in enumerate(uniques.tolist())
+            }
+
+    def options(self, column: str) -> List[Any]:
+        """
+        Returns the distinct values of a column, in order of first appearance.
+        """
+        return list(self._bitmaps.get(column, {}))
+
+    def _column_bitmap(self, column: str, selected: Sequence[Any]) -> np.ndarray:
+        bitmaps = self._bitmaps[column]
+        result = self._none.copy()
+        for value in selected:
+            bitmap = bitmaps.get(value)
+            if bitmap is not None:
+                np.bitwise_or(result, bitmap, out=result)
+        return result
+
+    def bitmap(self, filter_state: Dict[str, Any], exclude: str = None) -> np.ndarray:
+        """
+        Returns the packed bitmap of the rows matching the filters.
+
+        Args:
+          filter_state (dict): The UI filters; only indexed columns are used.
+          exclude (str): Column to leave out (used for per-option counts).
+        """
+        result = self._all.copy()
+        for column in self.columns:
+            selected = filter_state.get(column)
+            if selected and column != exclude:
+                np.bitwise_and(result, self._column_bitmap(column, selected), out=result)
+        return result
+
+    def positions(self, filter_state: Dict[str, Any]) -> np.ndarray:
+        """
+        Returns the row positions matching the filters.
+        """
+        return np.flatnonzero(np.unpackbits(self.bitmap(filter_state), count=self.n_rows))
+
+    def count(self, filter_state: Dict[str, Any]) -> int:
+        return _popcount(self.bitmap(filter_state))
+
+    def filter(self, filter_state: Dict[str, Any]) -> pd.DataFrame:
+        """
+        Returns the rows of the snapshot matching the filters.
+        """
+        if not any(filter_state.get(column) for column in self.columns):
+            return self.frame
+        return self.frame.take(self.positions(filter_state))
+
+    def option_counts(self, column: str, filter_state: Dict[str, Any]) -> Dict[Any, int]:
+        """
+        Counts the rows of each option of a column under the other filters, i.e.
+        how many rows selecting that option would add.
+        """
+        others = self.bitmap(filter_state, exclude=column)
+        return {
+            value: _popcount(np.bitwise_and(bitmap, others))
+            for value, bitmap in self._bitmaps.get(column, {}).items()
+        }
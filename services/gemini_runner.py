@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent execution engine for Gemini calls.
+It fans clusters out over asyncio with bounded concurrency, request/token rate
+limits and jittered exponential backoff, isolating the errors of each cluster.
+The rate limits are charged per request sent (see services/rate_limit.py).
+"""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, List, Optional
+
+from config.settings import GEMINI_CONCURRENCY, GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE
+from services.gemini_service import suggest_campaign_from_cluster
+from services.rate_limit import RateLimiter, limited
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: rate limit and transient server errors.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# ------------------------------
+# 1) Retry policy
+# ------------------------------
+def is_retryable(error: Exception) -> bool:
+    """
+    Returns True for rate limit (429) and transient server (5xx) errors.
+    """
+    # google.api_core exceptions (and FakeAPIError) expose the HTTP status as `code`.
+    return getattr(error, "code", None) in RETRYABLE_STATUS_CODES
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
+    """
+    Exponential backoff with full jitter: uniform in [0, min(max_delay, base * 2^attempt)].
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+# ------------------------------
+# 2) Fan-out
+# ------------------------------
+@dataclass
+class ClusterResult:
+    """
+    Outcome of one cluster. Exactly one of `result` and `error` is set.
+    """
+    cluster_id: str
+    result: Any = None
+    error: Optional[Exception] = None
+    attempts: int = 0
+    latency_s: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+async def iter_results(rows: List[dict], call: Callable[[dict], Any],
+                       concurrency: int = GEMINI_CONCURRENCY,
+                       requests_per_minute: float = GEMINI_REQUESTS_PER_MINUTE,
+                       tokens_per_minute: Optional[float] = GEMINI_TOKENS_PER_MINUTE,
+                       max_retries: int = 5, base_delay: float = 1.0,
+                       max_delay: float = 60.0,
+                       limiter: Optional[RateLimiter] = None) -> AsyncIterator[ClusterResult]:
+    """
+    Runs `call(row)` for every row concurrently and yields results in completion order.
+
+    The blocking `call` runs in worker threads, with `limiter` current, so every
+    Gemini request it sends (repairs and escalations too) is charged to the
+    rate limits. Retryable errors are retried with
+    jittered exponential backoff; any other error (or running out of retries) is
+    recorded in the ClusterResult of that row and the run goes on.
+
+    Args:
+      rows (List[dict]): Cluster dictionaries, each with a 'cluster_id'.
+      call (Callable): Blocking function that generates the result of one row.
+      concurrency (int): Maximum calls in flight.
+      requests_per_minute (float): Request rate limit.
+      tokens_per_minute (float): Token rate limit (prompt + output), or None to disable it.
+      max_retries (int): Retries of a row after its first attempt.
+      base_delay (float): Base of the exponential backoff, in seconds.
+      max_delay (float): Maximum backoff, in seconds.
+      limiter (RateLimiter): Limiter shared with other runs of the same key. When
+        omitted, one is built from `requests_per_minute` and `tokens_per_minute`.
+
+    Yields:
+      ClusterResult: One per row, as soon as it finishes.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    if limiter is None:
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    def limited_call(row: dict):
+        with limited(limiter):
+            return call(row)
+
+    async def run_one(row: dict) -> ClusterResult:
+        outcome = ClusterResult(cluster_id=str(row.get("cluster_id")))
+        started_at = time.perf_counter()
+        async with semaphore:
+            for attempt in range(max_retries + 1):
+                outcome.attempts = attempt + 1
+                try:
+                    outcome.result = await asyncio.to_thread(limited_call, row)
+                    outcome.error = None
+                    break
+                except Exception as e:
+                    outcome.error = e
+                    if attempt == max_retries or not is_retryable(e):
+                        logger.error(f"Cluster {outcome.cluster_id} falhou após {attempt + 1} tentativas: {e}")
+                        break
+                    await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+        outcome.latency_s = time.perf_counter() - started_at
+        return outcome
+
+    tasks = [asyncio.create_task(run_one(row)) for row in rows]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def suggest_campaigns_concurrently(rows: List[dict], user_notes: str, api_key: str, model=None,
+                                   on_result: Optional[Callable[[ClusterResult], None]] = None,
+                                   **limits) -> List[ClusterResult]:
+    """
+    Calls suggest_campaign_from_cluster for every row through iter_results.
+
+    Args:
+      rows (List[dict]): Cluster dictionaries, each with a 'cluster_id'.
+      user_notes (str): Additional user notes about the campaign objective.
+      api_key (str): The Gemini API key for authentication.
+      model: Optional model shared by all calls (e.g. a FakeGenerativeModel).
+      on_result (Callable): Called with each ClusterResult as soon as it finishes.
+      **limits: concurrency, requests_per_minute, tokens_per_minute, max_retries,
+        base_delay and max_delay, forwarded to iter_results.
+
+    Returns:
+      List[ClusterResult]: The results in completion order.
+    """
+    def call(row: dict):
+        return suggest_campaign_from_cluster(row, user_notes, api_key=api_key, model=model)
+
+    async def collect() -> List[ClusterResult]:
+        results = []
+        async for outcome in iter_results(rows, call, **limits):
+            if on_result is not None:
+                on_result(outcome)
+            results.append(outcome)
+        return results
+
+    return asyncio.run(collect())
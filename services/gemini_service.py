@@ -5,12 +5,28 @@ It defines the input and output schemas and the function that interacts with the
 """
 import os
 import json
+import time
+import threading
+from datetime import timedelta
+from dataclasses import dataclass
 from enum import Enum
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import logging
 
-import google.generativeai as genai
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+
+from config.settings import (
+    GEMINI_CONTEXT_CACHE, GEMINI_CONTEXT_CACHE_TTL_SECONDS, GEMINI_OUTPUT_TOKENS_PER_CAMPAIGN, MODEL_GEMINI,
+    MODEL_GEMINI_FAST, MODEL_GEMINI_FAST_MAX_REPAIRS, PROMPT_TABULAR, PROMPT_TOKEN_BUDGET,
+)
+from services.cache_service import SuggestionCache, make_cache_key
+from services.metrics import get_default_metrics
+from services.rate_limit import current_limiter
+from services.result_store import ResultStore
+from services.prompt_encoding import (
+    COPY_PROMPT_FIELDS, PROMPT_FIELDS, PromptBudgetError, check_budget, encode_cluster, encode_for_prompt,
+    encode_row, estimate_tokens, to_json,
+)
 
 # Configuração do logger
 logging.basicConfig(level=logging.INFO)
@@ -20,25 +36,59 @@ logger = logging.getLogger(__name__)
 #1) Define the exit CONTRACT
 # ------------------------------
 class Channel(str, Enum):
-    EMAIL = "EMAIL"
-    PUSH = "PUSH"
+    EMAIL = "Email"
+    PUSH = "Push"
 
-class Message(BaseModel):
-    channel: Channel
-    audience_notes: List[str] = Field(
-        description="Notas sobre subalvos/segmentos dentro do cluster"
-    )
-    message: str
-    cta: str
-    preferred_send_window: str  # Ex.: "Tue 10:00-12:00 (America/Sao_Paulo)"
-    kpis: List[str]  # Ex.: ["open_rate", "ctr", "conversion_rate"]
+# Message length limits per channel (min, max characters), from SYSTEM_INSTRUCTION.
+MESSAGE_LENGTH_LIMITS = {
+    Channel.PUSH: (60, 90),
+    Channel.EMAIL: (35, 45),
+}
+
+# "HH:mm" (ex.: "12:45") or a short window (ex.: "10h ou 14h").
+HORARIO_PATTERN = r"^(?:[01]\d|2[0-3]):[0-5]\d$|^\d{1,2}h ou \d{1,2}h$"
+
+class Campaign(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    cluster_id: Optional[str] = None  # echoed back in batched requests
+    mensagem: str
+    canal: Channel
+    horario: str = Field(pattern=HORARIO_PATTERN)
+    oferta: str
+    estimativa_engajamento: str = Field(pattern=r"\d+(?:[.,]\d+)?\s*%")
+
+    @model_validator(mode="after")
+    def check_message_length(self):
+        low, high = MESSAGE_LENGTH_LIMITS[self.canal]
+        if not low <= len(self.mensagem) <= high:
+            raise ValueError(
+                f"mensagem de {self.canal.value} deve ter entre {low} e {high} caracteres "
+                f"(tem {len(self.mensagem)})"
+            )
+        return self
 
 class CampaignSuggestion(BaseModel):
-    campaign_title: str
-    objective: str  # Ex.: "awareness" | "engagement" | "conversion" | "retention"
-    rationale: str
-    budget_hint: Optional[str] = None
-    messages: List[Message]
+    campanhas: List[Campaign]
+
+# Same contract, in the OpenAPI subset accepted as `response_schema` by Gemini.
+_CAMPAIGN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "cluster_id": {"type": "string"},
+        "mensagem": {"type": "string"},
+        "canal": {"type": "string", "enum": [c.value for c in Channel]},
+        "horario": {"type": "string"},
+        "oferta": {"type": "string"},
+        "estimativa_engajamento": {"type": "string"},
+    },
+    "required": ["mensagem", "canal", "horario", "oferta", "estimativa_engajamento"],
+}
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {"campanhas": {"type": "array", "items": _CAMPAIGN_SCHEMA}},
+    "required": ["campanhas"],
+}
 
 # ---------------------------------
 #2) System prompt (fixed rules)
@@ -127,49 +177,917 @@ NÃO incluir explicações fora do JSON.
 """
 
 # ------------------------------------------------
-# 3) Function that calls Gemini with Structured JSON
+# 3) Long-lived model registry
+# ------------------------------------------------
+
+# Plain dict accepted by generate_content, so callers don't need the SDK types.
+GENERATION_CONFIG = {
+    "temperature": 0.5,
+    "response_mime_type": "application/json",
+    "response_schema": RESPONSE_SCHEMA,
+}
+
+# key -> (model, monotonic time after which it must be rebuilt, None if never)
+_model_registry: Dict[Tuple[str, str, bool, str], Tuple[object, Optional[float]]] = {}
+_model_registry_lock = threading.Lock()
+_configured_api_key: Optional[str] = None
+
+# A context-cached model is rebuilt this long before its cache expires.
+CONTEXT_CACHE_RENEW_MARGIN_SECONDS = min(300, GEMINI_CONTEXT_CACHE_TTL_SECONDS / 10)
+
+
+def _create_cached_model(model_name: str, system_instruction: str = SYSTEM_INSTRUCTION):
+    """
+    Creates a model backed by an explicit context cache holding the system instruction,
+    so the fixed prefix is not re-tokenized and billed at full price on every request.
+    """
+    import google.generativeai as genai
+    from google.generativeai import caching
+
+    cached_content = caching.CachedContent.create(
+        model=model_name if model_name.startswith("models/") else f"models/{model_name}",
+        display_name="marketing-copilot-system-instruction",
+        system_instruction=system_instruction,
+        ttl=timedelta(seconds=GEMINI_CONTEXT_CACHE_TTL_SECONDS),
+    )
+    return genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+
+
+def get_model(api_key: str, model_name: str = MODEL_GEMINI, use_context_cache: bool = GEMINI_CONTEXT_CACHE,
+              system_instruction: str = SYSTEM_INSTRUCTION):
+    """
+    Returns a configured Gemini model, created once per process for each
+    (api_key, model_name, use_context_cache, system_instruction).
+
+    The rules in SYSTEM_INSTRUCTION are passed as the model's system instruction
+    instead of being pasted into every prompt. With `use_context_cache`, they are
+    stored in an explicit context cache; if the API refuses it (e.g. the prefix is
+    below the model's minimum cacheable size), the plain system instruction is used.
+    The context cache lives GEMINI_CONTEXT_CACHE_TTL_SECONDS, so a model built on it
+    is replaced with one on a new cache shortly before it expires.
+
+    Note: `genai.configure` is process-wide, so a process should use a single key.
+
+    Args:
+      api_key (str): The Gemini API key for authentication.
+      model_name (str): Name of the Gemini model.
+      use_context_cache (bool): Whether to cache the system instruction explicitly.
+      system_instruction (str): The fixed rules (SYSTEM_INSTRUCTION or COPY_SYSTEM_INSTRUCTION).
+
+    Returns:
+      genai.GenerativeModel: The shared model.
+    """
+    global _configured_api_key
+    import google.generativeai as genai  # deferred: the SDK is slow to import
+
+    key = (api_key, model_name, use_context_cache, system_instruction)
+    with _model_registry_lock:
+        model, expires_at = _model_registry.get(key, (None, None))
+        if model is not None and (expires_at is None or time.monotonic() < expires_at):
+            return model
+        if model is not None:
+            logger.info(f"Cache de contexto de '{model_name}' perto de expirar; criando um novo.")
+            model = None
+
+        if api_key != _configured_api_key:
+            genai.configure(api_key=api_key)
+            _configured_api_key = api_key
+            logger.info("Configuração da API do Gemini concluída.")
+
+        if use_context_cache:
+            try:
+                model = _create_cached_model(model_name, system_instruction)
+                expires_at = time.monotonic() + GEMINI_CONTEXT_CACHE_TTL_SECONDS - CONTEXT_CACHE_RENEW_MARGIN_SECONDS
+            except Exception as e:
+                logger.warning(f"Cache de contexto indisponível para '{model_name}', usando system instruction: {e}")
+        if model is None:
+            model, expires_at = genai.GenerativeModel(model_name, system_instruction=system_instruction), None
+        logger.info(f"Modelo '{model_name}' carregado com sucesso.")
+
+        _model_registry[key] = (model, expires_at)
+        return model
+
+
+def clear_model_registry():
+    """
+    Drops every registered model (e.g. after rotating the API key).
+    """
+    global _configured_api_key
+    with _model_registry_lock:
+        _model_registry.clear()
+        _configured_api_key = None
+
+
+def token_counts(resp) -> Tuple[int, int]:
+    """
+    Returns the (prompt, output) tokens of a response, 0 when it has no usage_metadata.
+    """
+    metadata = getattr(resp, "usage_metadata", None)
+    return (getattr(metadata, "prompt_token_count", 0) or 0, getattr(metadata, "candidates_token_count", 0) or 0)
+
+
+@dataclass
+class UsageTotals:
+    """
+    Token usage of every Gemini response in this process (from usage_metadata).
+    """
+    calls: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def record(self, resp):
+        prompt_tokens, output_tokens = token_counts(resp)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.output_tokens += output_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.output_tokens
+
+
+usage = UsageTotals()
+
+
+@dataclass
+class RepairStats:
+    """
+    Targeted repair retries: how often responses needed them and what they cost.
+    """
+    responses: int = 0
+    repaired_responses: int = 0
+    repair_requests: int = 0
+    items_repaired: int = 0
+    items_failed: int = 0
+    repair_latency_s: float = 0.0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def record(self, repair_requests: int, items_repaired: int, items_failed: int, latency_s: float):
+        with self._lock:
+            self.responses += 1
+            self.repaired_responses += 1 if repair_requests else 0
+            self.repair_requests += repair_requests
+            self.items_repaired += items_repaired
+            self.items_failed += items_failed
+            self.repair_latency_s += latency_s
+
+
+repair_stats = RepairStats()
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in e['loc']) or 'campanha'}: {e['msg']}" for e in error.errors()
+    )
+
+
+def validate_campaigns(text: str) -> Tuple[List[Any], List[Optional[dict]], Dict[int, str]]:
+    """
+    Validates each item of the 'campanhas' list of a response against Campaign.
+
+    Args:
+      text (str): The raw response of the model.
+
+    Returns:
+      The raw items, the validated items (None where invalid) and the validation
+      errors by position. A response that is not a 'campanhas' list counts as a
+      single invalid item.
+    """
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return [text], [None], {0: "a resposta não é um JSON válido"}
+    items = data.get("campanhas") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return [data], [None], {0: "a resposta não segue o schema {\"campanhas\": [...]}"}
+
+    validated: List[Optional[dict]] = []
+    errors: Dict[int, str] = {}
+    for position, item in enumerate(items):
+        try:
+            validated.append(Campaign.model_validate(item).model_dump(mode="json", exclude_none=True))
+        except ValidationError as e:
+            validated.append(None)
+            errors[position] = _format_validation_error(e)
+    return items, validated, errors
+
+
+def _build_repair_prompt(cluster_dict: dict, user_notes: str, failing: List[Tuple[Any, str]]) -> str:
+    corrections = "\n".join(
+        f"- Campanha {json.dumps(item, ensure_ascii=False, default=str)}\n  Erros: {error}"
+        for item, error in failing
+    )
+    return (
+        "As campanhas abaixo, geradas para o cluster a seguir, violam o contrato de saída.\n"
+        f"{corrections}\n\n"
+        f"Corrija SOMENTE essas {len(failing)} campanhas e responda com "
+        '{"campanhas": [...]} na mesma ordem, sem incluir as demais.\n\n'
+        f"Cluster JSON:\n{to_json(encode_row(cluster_dict))}\n\n"
+        f"Notas do usuário/Objetivo da Campanha:\n{user_notes}"
+    )
+
+
+def _generate(model, prompt: str, generation_config: dict = GENERATION_CONFIG,
+              token_budget: int = PROMPT_TOKEN_BUDGET, system_instruction: str = SYSTEM_INSTRUCTION,
+              expected_campaigns: int = 1):
+    # Fail before paying for a request that is over budget
+    prompt_tokens = check_budget(prompt, token_budget)
+    limiter = current_limiter()
+    if limiter is not None:
+        # Every request sent counts: system instruction, prompt and the expected answer
+        limiter.acquire(estimate_tokens(system_instruction) + prompt_tokens
+                        + expected_campaigns * GEMINI_OUTPUT_TOKENS_PER_CAMPAIGN)
+    resp = model.generate_content(contents=prompt, generation_config=generation_config)
+    usage.record(resp)
+    return resp
+
+
+# ------------------------------------------------
+# 4) Function that calls Gemini with Structured JSON
 # ------------------------------------------------
-def suggest_campaign_from_cluster(cluster_dict: dict, user_notes: str, api_key: str) -> dict:
+def suggest_campaign_from_cluster(cluster_dict: dict, user_notes: str, api_key: str, model=None,
+                                  cache: Optional[SuggestionCache] = None, refresh: bool = False,
+                                  model_name: str = MODEL_GEMINI, max_repairs: int = 2,
+                                  store: Optional[ResultStore] = None) -> dict:
     """
     Sends the cluster and user notes to Gemini and returns a validated dictionary.
 
+    The response is constrained by RESPONSE_SCHEMA and each campaign is validated
+    with Campaign. Only the campaigns that fail validation are re-requested, with
+    the validation errors fed back, up to `max_repairs` times.
+
     Args:
       cluster_dict (dict): Dictionary with cluster information.
       user_notes (str): Additional user notes about the campaign objective.
       api_key (str): The Gemini API key for authentication.
+      model: Optional model exposing `generate_content` (e.g. a fake for tests).
+        When omitted, the registered model for `api_key` and `model_name` is used.
+      cache (SuggestionCache): Optional cache of previous suggestions. None bypasses it.
+      refresh (bool): Ignore a cached suggestion and store the new one in its place.
+      model_name (str): Name of the Gemini model, when `model` is omitted.
+      max_repairs (int): Repair requests allowed for the invalid campaigns.
+      store (ResultStore): Optional store that keeps every new suggestion as a version.
 
     Returns:
-      dict: A dictionary with the campaign suggestion.
+      dict: The suggestion as {"campanhas": [...]}, with only valid campaigns.
+
+    Raises:
+      ValueError: If no campaign is valid after the repairs.
     """
+    # Timed as the "gemini" stage, with tokens, repairs and cache hits
+    metrics, called_at = get_default_metrics(), time.perf_counter()
+    prompt_tokens = output_tokens = repair_requests = 0
+    cache_key = None
+    cache_model_name = getattr(model, "model_name", type(model).__name__) if model is not None else model_name
+    if cache is not None or store is not None:
+        cache_key = make_cache_key(cluster_dict, user_notes, cache_model_name, SYSTEM_INSTRUCTION)
+    if cache is not None:
+        if not refresh:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                logger.info("Sugestão encontrada no cache.")
+                metrics.observe("gemini", time.perf_counter() - called_at, model=cache_model_name, cache_hit=1)
+                return json.loads(cached)
+
     try:
-        # Configure the API with the key passed as an argument.
-        genai.configure(api_key=api_key)
-        logger.info("Configuração da API do Gemini concluída.")
+        started_at = time.perf_counter()
+        if model is None:
+            # Reuse the model configured for this key (system instruction included).
+            model = get_model(api_key, model_name)
 
-        # Attempt to initialize the model.
-        model = genai.GenerativeModel("gemini-1.5-pro")
-        logger.info("Modelo 'gemini-1.5-pro' carregado com sucesso.")
-        
         user_prompt = (
-            f"Instruções do sistema: {SYSTEM_INSTRUCTION}\n\n"
             "Com base no cluster e nas notas do usuário a seguir, proponha uma campanha coesa, "
             "com 1 a 3 mensagens por canal. "
             "Use janelas de envio compatíveis com a timezone do cluster. "
-            f"Cluster JSON:\n{json.dumps(cluster_dict, ensure_ascii=False)}\n\n"
+            f"Cluster JSON:\n{encode_cluster(cluster_dict)}\n\n"
             f"Notas do usuário/Objetivo da Campanha:\n{user_notes}"
         )
 
-        resp = model.generate_content(
-            contents=user_prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.5,
-                response_mime_type="application/json"
-            )
+        # 1 to 3 messages per channel
+        resp = _generate(model, user_prompt, expected_campaigns=3)
+        prompt_tokens, output_tokens = token_counts(resp)
+        items, campaigns, errors = validate_campaigns(resp.text)
+
+        # Targeted repair: re-request only the invalid campaigns
+        repair_requests, items_repaired, repair_started_at = 0, 0, time.perf_counter()
+        while errors and repair_requests < max_repairs:
+            repair_requests += 1
+            positions = sorted(errors)
+            logger.info(f"Corrigindo {len(positions)} campanhas inválidas (tentativa {repair_requests}): {errors}")
+            resp = _generate(model, _build_repair_prompt(
+                cluster_dict, user_notes, [(items[p], errors[p]) for p in positions]
+            ), expected_campaigns=len(positions))
+            prompt_tokens, output_tokens = map(sum, zip((prompt_tokens, output_tokens), token_counts(resp)))
+            fixed_items, fixed, fixed_errors = validate_campaigns(resp.text)
+            errors = {}
+            for k, position in enumerate(positions):
+                if k < len(fixed) and fixed[k] is not None:
+                    campaigns[position] = fixed[k]
+                    items_repaired += 1
+                else:
+                    items[position] = fixed_items[k] if k < len(fixed_items) else items[position]
+                    errors[position] = fixed_errors.get(k, "campanha ausente na resposta de correção")
+
+        repair_stats.record(
+            repair_requests, items_repaired, len(errors),
+            time.perf_counter() - repair_started_at if repair_requests else 0.0
         )
+        if errors:
+            logger.warning(f"{len(errors)} campanhas descartadas após {repair_requests} correções: {errors}")
+
+        valid = [campaign for campaign in campaigns if campaign is not None]
+        if not valid:
+            raise ValueError(f"O Gemini não retornou nenhuma campanha válida: {errors}")
+        suggestion = CampaignSuggestion.model_validate({"campanhas": valid}).model_dump(mode="json", exclude_none=True)
+
+        if cache is not None:
+            cache.set(cache_key, json.dumps(suggestion, ensure_ascii=False),
+                      latency_s=time.perf_counter() - started_at)
+        if store is not None and cluster_dict.get("cluster_id") is not None:
+            store.add(cluster_dict["cluster_id"], suggestion, cache_model_name, cache_key, user_notes)
+        metrics.observe("gemini", time.perf_counter() - called_at, model=cache_model_name, cache_hit=0,
+                        prompt_tokens=prompt_tokens, output_tokens=output_tokens, retries=repair_requests)
+        return suggestion
         
-        return resp.text
-        return suggestion.model_dump()
-        
     except Exception as e:
         logger.error(f"Ocorreu um erro ao chamar o Gemini: {e}")
-        raise e
\ No newline at end of file
+        metrics.observe("gemini", time.perf_counter() - called_at, model=cache_model_name, cache_hit=0,
+                        prompt_tokens=prompt_tokens, output_tokens=output_tokens, retries=repair_requests, error=1)
+        raise e
+
+
+# ------------------------------------------------
+# 5) Batched generation using the "rows" contract
+# ------------------------------------------------
+
+# Default prompt budget (in tokens) for the cluster payload of a single request.
+DEFAULT_BATCH_TOKEN_BUDGET = 8000
+
+
+def _row_to_json(row: dict) -> str:
+    return to_json(encode_row(row))
+
+
+def chunk_rows(rows: List[dict], token_budget: int = DEFAULT_BATCH_TOKEN_BUDGET,
+               max_rows_per_chunk: int = 50) -> List[List[dict]]:
+    """
+    Packs cluster rows into chunks that fit the token budget.
+
+    A row larger than the budget is sent alone in its own chunk.
+
+    Args:
+      rows (List[dict]): Cluster dictionaries, each with a 'cluster_id'.
+      token_budget (int): Maximum estimated tokens of the rows in a chunk.
+      max_rows_per_chunk (int): Hard limit of rows per chunk.
+
+    Returns:
+      List[List[dict]]: The rows grouped in chunks, preserving their order.
+    """
+    chunks: List[List[dict]] = []
+    current: List[dict] = []
+    current_tokens = 0
+
+    for row in rows:
+        row_tokens = estimate_tokens(_row_to_json(row))
+        if current and (current_tokens + row_tokens > token_budget or len(current) >= max_rows_per_chunk):
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(row)
+        current_tokens += row_tokens
+
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _build_batch_prompt(rows: List[dict], user_notes: str, feedback: Optional[Dict[str, str]] = None,
+                        fields: Dict[str, str] = PROMPT_FIELDS, tabular: bool = PROMPT_TABULAR) -> str:
+    tabular = tabular and len(rows) > 1
+    payload = encode_for_prompt(rows, fields, tabular, extra={"tz": "America/Sao_Paulo"})
+    layout = "Em 'rows', cada item é uma lista com os valores das colunas nomeadas em 'cols'.\n" if tabular else ""
+    corrections = ""
+    if feedback:
+        # Validation errors of the previous attempt for these clusters
+        corrections = "Na tentativa anterior, estas campanhas violaram o contrato; corrija-as:\n" + "\n".join(
+            f"- cluster_id {cluster_id}: {error}" for cluster_id, error in feedback.items()
+        ) + "\n\n"
+    return (
+        "Inclua em cada item de 'campanhas' o campo 'cluster_id' do item correspondente de 'rows'.\n"
+        f"{layout}\n"
+        f"{corrections}"
+        f"Entrada JSON:\n{payload}\n\n"
+        f"Notas do usuário/Objetivo da Campanha:\n{user_notes}"
+    )
+
+
+def _parse_campaigns(text: str) -> List[dict]:
+    """
+    Extracts the 'campanhas' list from the model response, or [] if it is malformed.
+    """
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return []
+    if isinstance(data, dict):
+        data = data.get("campanhas", [])
+    if not isinstance(data, list):
+        return []
+    return [item for item in data if isinstance(item, dict)]
+
+
+def _align_campaigns(chunk: List[dict], campaigns: List[dict]) -> Dict[str, dict]:
+    """
+    Maps each campaign of a response back to the cluster_id of its input row.
+
+    Campaigns that echo a 'cluster_id' are matched by id. Campaigns without it are
+    matched by position, but only when the response has exactly one item per row.
+    Unknown or duplicated ids are discarded so that their rows are re-sent.
+    """
+    expected_ids = [str(row["cluster_id"]) for row in chunk]
+    same_length = len(campaigns) == len(chunk)
+    aligned: Dict[str, dict] = {}
+
+    for position, campaign in enumerate(campaigns):
+        cluster_id = campaign.get("cluster_id")
+        if cluster_id is None:
+            if not same_length:
+                continue
+            cluster_id = expected_ids[position]
+        cluster_id = str(cluster_id)
+        if cluster_id in expected_ids and cluster_id not in aligned:
+            aligned[cluster_id] = {**campaign, "cluster_id": cluster_id}
+
+    return aligned
+
+
+def _generate_with_backoff(model, prompt: str, generation_config: dict, max_retries: int = 5,
+                           base_delay: float = 1.0, max_delay: float = 60.0, **kwargs):
+    """
+    _generate, retrying rate limit (429) and transient server (5xx) errors with
+    jittered exponential backoff. Other errors are raised at once.
+    """
+    # Imported here: gemini_runner imports this module
+    from services.gemini_runner import backoff_delay, is_retryable
+
+    for attempt in range(max_retries + 1):
+        try:
+            return _generate(model, prompt, generation_config, **kwargs)
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(f"Erro transitório do Gemini ({e}); nova tentativa em {delay:.1f}s.")
+            time.sleep(delay)
+
+
+def _run_batches(rows: List[dict], model, build_prompt, complete, generation_config: dict,
+                 token_budget: int, max_rows_per_chunk: int, max_retries: int,
+                 system_instruction: str = SYSTEM_INSTRUCTION) -> Dict[str, dict]:
+    """
+    Sends the rows in chunks, validates the aligned campaigns and re-sends the failures.
+
+    `build_prompt(chunk, feedback)` builds the request of a chunk and
+    `complete(cluster_id, campaign)` turns a response item into a full campaign.
+    Transient API errors are retried with backoff (see _generate_with_backoff);
+    only the clusters still missing or invalid afterwards count against `max_retries`.
+    `token_budget` bounds the whole prompt of a request: the rows are packed into
+    what is left of it after the fixed part of the prompt (notes and framing). A
+    chunk whose prompt is still over the budget (e.g. with repair feedback) is
+    split in two; a single row over the budget is recorded as failed.
+    """
+    results: Dict[str, dict] = {}
+    feedback: Dict[str, str] = {}
+    oversized: set = set()
+    pending = list(rows)
+    repair_requests, first_pass_ok, repair_started_at = 0, 0, 0.0
+    rows_budget = max(1, token_budget - estimate_tokens(build_prompt([], {})))
+
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        if attempt:
+            logger.info(f"Reenviando {len(pending)} clusters sem campanha válida (tentativa {attempt}).")
+
+        chunks = chunk_rows(pending, rows_budget, max_rows_per_chunk)
+        while chunks:
+            chunk = chunks.pop(0)
+            chunk_feedback = {str(row["cluster_id"]): feedback[str(row["cluster_id"])]
+                              for row in chunk if str(row["cluster_id"]) in feedback}
+            repair_requests += 1 if attempt else 0
+            try:
+                resp = _generate_with_backoff(model, build_prompt(chunk, chunk_feedback), generation_config,
+                                              token_budget=token_budget, system_instruction=system_instruction,
+                                              expected_campaigns=len(chunk))
+            except PromptBudgetError as e:
+                # Not transient: resending the same prompt would fail again
+                if len(chunk) == 1:
+                    logger.error(f"Cluster {chunk[0]['cluster_id']} ignorado: {e}")
+                    oversized.add(str(chunk[0]["cluster_id"]))
+                    continue
+                logger.warning(f"Lote de {len(chunk)} clusters acima do limite de tokens; dividindo em dois.")
+                chunks[:0] = [chunk[:len(chunk) // 2], chunk[len(chunk) // 2:]]
+                continue
+            except Exception as e:
+                logger.error(f"Ocorreu um erro ao chamar o Gemini para um lote de {len(chunk)} clusters: {e}")
+                continue
+            for cluster_id, campaign in _align_campaigns(chunk, _parse_campaigns(resp.text)).items():
+                try:
+                    results[cluster_id] = Campaign.model_validate(
+                        complete(cluster_id, campaign)
+                    ).model_dump(mode="json", exclude_none=True)
+                    feedback.pop(cluster_id, None)
+                except ValidationError as e:
+                    feedback[cluster_id] = _format_validation_error(e)
+
+        pending = [row for row in pending if str(row["cluster_id"]) not in results
+                   and str(row["cluster_id"]) not in oversized]
+
+        if attempt == 0:
+            first_pass_ok, repair_started_at = len(results), time.perf_counter()
+
+    repair_stats.record(
+        repair_requests, len(results) - first_pass_ok, len(pending) + len(oversized),
+        time.perf_counter() - repair_started_at if repair_requests else 0.0
+    )
+    if pending:
+        logger.error(f"{len(pending)} clusters ficaram sem campanha após {max_retries} novas tentativas.")
+    if oversized:
+        logger.error(f"{len(oversized)} clusters ficaram sem campanha por excederem o limite de tokens.")
+    return results
+
+
+def suggest_campaigns_for_clusters(rows: List[dict], user_notes: str, api_key: str,
+                                   token_budget: int = DEFAULT_BATCH_TOKEN_BUDGET,
+                                   max_rows_per_chunk: int = 50,
+                                   max_retries: int = 2, model=None,
+                                   model_name: str = MODEL_GEMINI) -> Dict[str, dict]:
+    """
+    Generates one campaign per cluster, sending several clusters per request.
+
+    The rows are packed into token-budgeted chunks following the {"rows": [...]}
+    contract of SYSTEM_INSTRUCTION. The 'campanhas' of each response are mapped back
+    to their cluster_id and validated with Campaign; only the rows that came back
+    missing, misaligned or invalid are re-sent (with their validation errors), up
+    to `max_retries` times.
+
+    Args:
+      rows (List[dict]): Cluster dictionaries, each with a 'cluster_id'.
+      user_notes (str): Additional user notes about the campaign objective.
+      api_key (str): The Gemini API key for authentication.
+      token_budget (int): Maximum estimated tokens of the prompt of a request.
+      max_rows_per_chunk (int): Hard limit of rows per request.
+      max_retries (int): How many times missing rows are re-sent.
+      model: Optional model exposing `generate_content` (e.g. a fake for tests).
+      model_name (str): Name of the Gemini model, when `model` is omitted.
+
+    Returns:
+      Dict[str, dict]: The campaign of each cluster, keyed by cluster_id. Clusters
+      that could not be generated after the retries are left out.
+    """
+    if model is None:
+        model = get_model(api_key, model_name)
+
+    return _run_batches(
+        rows, model,
+        build_prompt=lambda chunk, feedback: _build_batch_prompt(chunk, user_notes, feedback),
+        complete=lambda cluster_id, campaign: campaign,
+        generation_config=GENERATION_CONFIG,
+        token_budget=token_budget, max_rows_per_chunk=max_rows_per_chunk, max_retries=max_retries,
+    )
+
+
+# ------------------------------------------------
+# 6) Rule-based fields, with Gemini writing only the copy
+# ------------------------------------------------
+
+# Rule 1 of SYSTEM_INSTRUCTION; 'canal', 'horario' and 'oferta' come from
+# services/rule_engine.py and are passed in as constraints.
+COPY_SYSTEM_INSTRUCTION = """
+Você é um redator de marketing multicanal do Globoplay. Receberá um JSON com 'rows';
+cada item traz o perfil do cluster e os campos JÁ DEFINIDOS 'canal', 'horario' e 'oferta'.
+
+OBJETIVO: para CADA item de 'rows', escreva UMA mensagem (não agrupar), preservando a ordem.
+
+SAÍDA OBRIGATÓRIA:
+Responda SOMENTE com JSON válido no schema:
+{ "campanhas": [ { "cluster_id": str, "mensagem": str, "estimativa_engajamento": str }, ... ] }
+- 'estimativa_engajamento' deve ser uma string com percentual e, opcionalmente, comentário em parênteses (ex.: "2.3% (alto tempo de leitura)").
+
+MENSAGEM (copy curta e com CTA; usar a fórmula: [GANCHO específico] + [BENEFÍCIO] + [OFERTA] + [CTA curto])
+- Ajuste ao interesse:
+  * esportes → chame "melhores momentos", "rodada", "ao vivo".
+  * noticias → "análise exclusiva", "guia prático" (ex.: eleições).
+  * receitas → "cardápio/coleção da semana", "lista de compras", "em X minutos".
+- Tom por idade:
+  * 18–24: direto/energético (ex.: "Veja agora", "Corre").
+  * 25–44: benefício prático + ação clara (ex.: "Entenda e comece hoje").
+  * 45–64: credibilidade e clareza (ex.: "Análise exclusiva", "Guia prático").
+  * 65+: simples e didático (ex.: "Passo a passo", "Acesso fácil").
+- Limites pelo 'canal' do item:
+  * Push: 60–90 caracteres, sem jargão.
+  * Email (assunto/linha curta): 35–45 caracteres. (A mensagem deve caber como linha de assunto.)
+- Para noticias sensíveis (ex.: eleições), evite emoji e sensacionalismo; enfatize utilidade e serenidade.
+- Se subscriber = false, inclua a 'oferta' do item na mensagem.
+
+NÃO altere 'canal', 'horario' ou 'oferta'. Não invente dados PII e respeite a LGPD.
+NÃO incluir explicações fora do JSON.
+"""
+
+COPY_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "campanhas": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "cluster_id": {"type": "string"},
+                    "mensagem": {"type": "string"},
+                    "estimativa_engajamento": {"type": "string"},
+                },
+                "required": ["cluster_id", "mensagem", "estimativa_engajamento"],
+            },
+        },
+    },
+    "required": ["campanhas"],
+}
+
+COPY_GENERATION_CONFIG = {**GENERATION_CONFIG, "response_schema": COPY_RESPONSE_SCHEMA}
+
+
+def suggest_copy_for_clusters(rows: List[dict], user_notes: str, api_key: str,
+                              plan: Optional[Dict[str, dict]] = None,
+                              token_budget: int = DEFAULT_BATCH_TOKEN_BUDGET,
+                              max_rows_per_chunk: int = 50,
+                              max_retries: int = 2, model=None,
+                              model_name: str = MODEL_GEMINI) -> Dict[str, dict]:
+    """
+    Generates one campaign per cluster with 'canal', 'horario' and 'oferta' from the
+    local rule engine; Gemini only writes 'mensagem' and 'estimativa_engajamento'.
+
+    Args:
+      rows (List[dict]): Cluster dictionaries, each with a 'cluster_id'.
+      user_notes (str): Additional user notes about the campaign objective.
+      api_key (str): The Gemini API key for authentication.
+      plan (Dict[str, dict]): Rule-based fields by cluster_id. Computed from `rows`
+        when omitted (see services.rule_engine.rule_plan).
+      token_budget (int): Maximum estimated tokens of the prompt of a request.
+      max_rows_per_chunk (int): Hard limit of rows per request.
+      max_retries (int): How many times missing or invalid rows are re-sent.
+      model: Optional model exposing `generate_content` (e.g. a fake for tests).
+      model_name (str): Name of the Gemini model, when `model` is omitted.
+
+    Returns:
+      Dict[str, dict]: The campaign of each cluster, keyed by cluster_id.
+    """
+    from services.rule_engine import rule_plan
+
+    if plan is None:
+        plan = rule_plan(rows)
+    if model is None:
+        model = get_model(api_key, model_name, system_instruction=COPY_SYSTEM_INSTRUCTION)
+
+    constrained = [{**row, **plan[str(row["cluster_id"])]} for row in rows]
+    return _run_batches(
+        constrained, model,
+        build_prompt=lambda chunk, feedback: _build_batch_prompt(chunk, user_notes, feedback, COPY_PROMPT_FIELDS),
+        # the rule-based fields win over anything the model echoes back
+        complete=lambda cluster_id, campaign: {**campaign, **plan[cluster_id], "cluster_id": cluster_id},
+        generation_config=COPY_GENERATION_CONFIG,
+        token_budget=token_budget, max_rows_per_chunk=max_rows_per_chunk, max_retries=max_retries,
+        system_instruction=COPY_SYSTEM_INSTRUCTION,
+    )
+
+
+def suggest_copy_for_cluster(cluster_dict: dict, user_notes: str, api_key: str, model=None,
+                             cache: Optional[SuggestionCache] = None, refresh: bool = False,
+                             model_name: str = MODEL_GEMINI, max_repairs: int = 2,
+                             store: Optional[ResultStore] = None) -> dict:
+    """
+    Single-cluster variant of suggest_copy_for_clusters, with the cache and store of
+    suggest_campaign_from_cluster: 'canal', 'horario' and 'oferta' come from the
+    rule engine and Gemini writes one message for that channel.
+
+    Args:
+      cluster_dict (dict): Dictionary with cluster information, including 'cluster_id'.
+      user_notes (str): Additional user notes about the campaign objective.
+      api_key (str): The Gemini API key for authentication.
+      model: Optional model exposing `generate_content` (e.g. a fake for tests).
+      cache (SuggestionCache): Optional cache of previous suggestions. None bypasses it.
+      refresh (bool): Ignore a cached suggestion and store the new one in its place.
+      model_name (str): Name of the Gemini model, when `model` is omitted.
+      max_repairs (int): How many times an invalid campaign is re-requested.
+      store (ResultStore): Optional store that keeps every new suggestion as a version.
+
+    Returns:
+      dict: The suggestion as {"campanhas": [campaign]}.
+
+    Raises:
+      ValueError: If no valid campaign came back after the repairs.
+    """
+    from services.rule_engine import rule_plan
+
+    metrics, called_at = get_default_metrics(), time.perf_counter()
+    cache_key = None
+    cache_model_name = getattr(model, "model_name", type(model).__name__) if model is not None else model_name
+    if cache is not None or store is not None:
+        cache_key = make_cache_key(cluster_dict, user_notes, cache_model_name, COPY_SYSTEM_INSTRUCTION)
+    if cache is not None and not refresh:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.info("Sugestão encontrada no cache.")
+            metrics.observe("gemini", time.perf_counter() - called_at, model=cache_model_name, cache_hit=1)
+            return json.loads(cached)
+
+    row = {**cluster_dict, "cluster_id": str(cluster_dict["cluster_id"])}
+    try:
+        started_at = time.perf_counter()
+        campaigns = suggest_copy_for_clusters([row], user_notes, api_key, plan=rule_plan([row]),
+                                              max_retries=max_repairs, model=model, model_name=model_name)
+        if row["cluster_id"] not in campaigns:
+            raise ValueError("O Gemini não retornou nenhuma campanha válida.")
+        suggestion = {"campanhas": [campaigns[row["cluster_id"]]]}
+
+        if cache is not None:
+            cache.set(cache_key, json.dumps(suggestion, ensure_ascii=False),
+                      latency_s=time.perf_counter() - started_at)
+        if store is not None:
+            store.add(cluster_dict["cluster_id"], suggestion, cache_model_name, cache_key, user_notes)
+        metrics.observe("gemini", time.perf_counter() - called_at, model=cache_model_name, cache_hit=0)
+        return suggestion
+
+    except Exception as e:
+        logger.error(f"Ocorreu um erro ao chamar o Gemini: {e}")
+        metrics.observe("gemini", time.perf_counter() - called_at, model=cache_model_name, cache_hit=0, error=1)
+        raise
+
+
+# ------------------------------------------------
+# 7) Tiered model routing
+# ------------------------------------------------
+@dataclass
+class Tier:
+    model_name: str
+    max_repairs: int = 2  # repair requests (single) or re-sends (batch) on this tier
+
+
+def default_tiers() -> List[Tier]:
+    """
+    The fast model first, then MODEL_GEMINI for what it could not answer.
+    """
+    return [Tier(MODEL_GEMINI_FAST, MODEL_GEMINI_FAST_MAX_REPAIRS), Tier(MODEL_GEMINI)]
+
+
+@dataclass
+class TierStats:
+    attempts: int = 0
+    successes: int = 0
+    latency_s: float = 0.0
+
+    @property
+    def success_rate(self) -> float:
+        return self.successes / self.attempts if self.attempts else 0.0
+
+    @property
+    def mean_latency_s(self) -> float:
+        return self.latency_s / self.attempts if self.attempts else 0.0
+
+
+@dataclass
+class RoutingStats:
+    """
+    Per-tier attempts, successes and latency, and how often clusters escalate.
+    """
+    requests: int = 0
+    escalations: int = 0
+
+    def __post_init__(self):
+        self.tiers: Dict[str, TierStats] = {}
+        self._lock = threading.Lock()
+
+    def add_requests(self, count: int):
+        with self._lock:
+            self.requests += count
+
+    def record(self, model_name: str, attempts: int, successes: int, latency_s: float, escalations: int):
+        with self._lock:
+            tier = self.tiers.setdefault(model_name, TierStats())
+            tier.attempts += attempts
+            tier.successes += successes
+            tier.latency_s += latency_s
+            self.escalations += escalations
+
+    @property
+    def escalation_rate(self) -> float:
+        return self.escalations / self.requests if self.requests else 0.0
+
+
+routing_stats = RoutingStats()
+
+
+def route_campaign_from_cluster(cluster_dict: dict, user_notes: str, api_key: str,
+                                suggest=suggest_campaign_from_cluster,
+                                tiers: Optional[List[Tier]] = None, models: Optional[Dict[str, Any]] = None,
+                                **kwargs) -> dict:
+    """
+    Calls a single-cluster generator on each tier until one returns a valid suggestion.
+
+    A tier fails when no campaign survives validation (after its repairs); the
+    request then escalates to the next tier. API errors (rate limits, timeouts,
+    network) and PromptBudgetError are raised as they are: a bigger model would
+    not fix them, and the caller's backoff (e.g. gemini_runner) handles the transient ones.
+
+    Args:
+      cluster_dict (dict): Dictionary with cluster information.
+      user_notes (str): Additional user notes about the campaign objective.
+      api_key (str): The Gemini API key for authentication.
+      suggest (Callable): suggest_campaign_from_cluster or suggest_copy_for_cluster.
+      tiers (List[Tier]): Models to try in order. Defaults to default_tiers().
+      models (Dict[str, Any]): Optional model object per tier name (e.g. fakes).
+      **kwargs: Forwarded to `suggest` (cache, refresh, store).
+
+    Returns:
+      dict: The suggestion of the first tier that succeeded, with the name of that
+      tier's model under "model".
+
+    Raises:
+      ValueError: The validation error of the last tier, if every tier failed.
+      Exception: Any other error of the tier that raised it.
+    """
+    tiers = tiers or default_tiers()
+    models = models or {}
+    routing_stats.add_requests(1)
+
+    for position, tier in enumerate(tiers):
+        started_at = time.perf_counter()
+        try:
+            suggestion = suggest(
+                cluster_dict, user_notes, api_key, model=models.get(tier.model_name),
+                model_name=tier.model_name, max_repairs=tier.max_repairs, **kwargs
+            )
+        except PromptBudgetError:
+            routing_stats.record(tier.model_name, 1, 0, time.perf_counter() - started_at, 0)
+            raise
+        except ValueError as e:
+            # No valid campaign (invalid JSON or failed validation after the repairs)
+            last = position == len(tiers) - 1
+            routing_stats.record(tier.model_name, 1, 0, time.perf_counter() - started_at, 0 if last else 1)
+            if last:
+                raise
+            logger.info(f"'{tier.model_name}' falhou ({e}); escalando para '{tiers[position + 1].model_name}'.")
+            continue
+        except Exception:
+            routing_stats.record(tier.model_name, 1, 0, time.perf_counter() - started_at, 0)
+            raise
+        routing_stats.record(tier.model_name, 1, 1, time.perf_counter() - started_at, 0)
+        return {**suggestion, "model": tier.model_name}
+
+
+def route_campaigns_for_clusters(rows: List[dict], user_notes: str, api_key: str,
+                                 generate=suggest_campaigns_for_clusters,
+                                 tiers: Optional[List[Tier]] = None, models: Optional[Dict[str, Any]] = None,
+                                 **kwargs) -> Dict[str, dict]:
+    """
+    Runs a batched generator on each tier, sending only the clusters still missing.
+
+    Args:
+      rows (List[dict]): Cluster dictionaries, each with a 'cluster_id'.
+      user_notes (str): Additional user notes about the campaign objective.
+      api_key (str): The Gemini API key for authentication.
+      generate (Callable): suggest_campaigns_for_clusters or suggest_copy_for_clusters.
+      tiers (List[Tier]): Models to try in order. Defaults to default_tiers().
+      models (Dict[str, Any]): Optional model object per tier name (e.g. fakes).
+      **kwargs: Forwarded to `generate` (e.g. plan, token_budget).
+
+    Returns:
+      Dict[str, dict]: The campaign of each cluster, keyed by cluster_id, with the
+      name of the model that answered it under "model".
+    """
+    tiers = tiers or default_tiers()
+    models = models or {}
+    routing_stats.add_requests(len(rows))
+
+    results: Dict[str, dict] = {}
+    pending = list(rows)
+    for position, tier in enumerate(tiers):
+        if not pending:
+            break
+        started_at = time.perf_counter()
+        generated = generate(pending, user_notes, api_key, model=models.get(tier.model_name),
+                             model_name=tier.model_name, max_retries=tier.max_repairs, **kwargs)
+        results.update({
+            cluster_id: {**campaign, "model": tier.model_name} for cluster_id, campaign in generated.items()
+        })
+        failed = len(pending) - len(generated)
+        escalated = failed if position < len(tiers) - 1 else 0
+        routing_stats.record(tier.model_name, len(pending), len(generated), time.perf_counter() - started_at, escalated)
+        pending = [row for row in pending if str(row["cluster_id"]) not in results]
+        if pending and escalated:
+            logger.info(f"{len(pending)} clusters escalados para '{tiers[position + 1].model_name}'.")
+    return results
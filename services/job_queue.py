@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide background job queue for the Streamlit app.
+Generation runs on a worker pool instead of the script thread, so a rerun does not
+throw the work away; pages keep the job ids in session_state and poll them.
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from config.settings import JOB_RETENTION_SECONDS, JOB_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    key: Optional[Hashable] = None
+    status: JobStatus = JobStatus.PENDING
+    result: Any = None
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    subscribers: int = 1  # submissions coalesced into this job
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED)
+
+    @property
+    def elapsed_s(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class JobQueue:
+    """
+    Runs submitted callables on a thread pool and keeps their outcome by job id.
+
+    Submissions with the same `key` while a job for it is pending or running are
+    coalesced: they get the id of that job instead of starting another call.
+    Finished jobs are dropped `retention_seconds` after they end.
+
+    Args:
+      max_workers (int): Size of the worker pool.
+      retention_seconds (int): How long finished jobs can still be polled.
+    """
+    def __init__(self, max_workers: int = JOB_WORKERS, retention_seconds: int = JOB_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._in_flight: Dict[Hashable, str] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Any], *args, key: Optional[Hashable] = None, **kwargs) -> str:
+        """
+        Queues `fn(*args, **kwargs)` and returns its job id.
+
+        Args:
+          fn (Callable): The work to run.
+          key (Hashable): Identity of the request, to coalesce identical submissions.
+        """
+        with self._lock:
+            self._prune()
+            if key is not None and key in self._in_flight:
+                job = self._jobs[self._in_flight[key]]
+                job.subscribers += 1
+                logger.info(f"Job {job.id} reaproveitado ({job.subscribers} solicitações).")
+                return job.id
+            job = Job(id=uuid.uuid4().hex, key=key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._in_flight[key] = job.id
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs):
+        job.started_at = time.time()
+        job.status = JobStatus.RUNNING
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = JobStatus.DONE
+        except Exception as e:
+            logger.error(f"Job {job.id} falhou: {e}")
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if job.key is not None and self._in_flight.get(job.key) == job.id:
+                    del self._in_flight[job.key]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Returns the job, or None if the id is unknown or has expired.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, job_ids: List[str]) -> Dict[str, Job]:
+        """
+        Returns the known jobs among `job_ids`, keyed by id.
+        """
+        with self._lock:
+            return {job_id: self._jobs[job_id] for job_id in job_ids if job_id in self._jobs}
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+_default_queue: Optional[JobQueue] = None
+_default_queue_lock = threading.Lock()
+
+
+def get_default_queue() -> JobQueue:
+    """
+    Returns the process-wide job queue, shared by every Streamlit session.
+    """
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = JobQueue()
+        return _default_queue
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight instrumentation of the hot path.
+Stages are timed with spans; the numeric attributes of a span (rows, bytes,
+tokens, retries, cache hits...) are also summed into counters. Recent durations
+are kept per stage for p50/p95, and every span goes to the configured sinks:
+logs, a JSONL file or a Prometheus-style text endpoint.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from config.settings import METRICS_JSONL_PATH, METRICS_PROMETHEUS_PORT, METRICS_SINKS, METRICS_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the exported Prometheus metrics.
+PROMETHEUS_PREFIX = "copiloto"
+
+_METRIC_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+@dataclass
+class SpanRecord:
+    name: str
+    started_at: float  # epoch seconds
+    duration_s: float
+    attrs: Dict[str, object] = field(default_factory=dict)
+
+
+# ------------------------------
+# 1) Sinks
+# ------------------------------
+class LogSink:
+    """
+    Logs every span.
+    """
+    def __init__(self, level: int = logging.INFO):
+        self.level = level
+
+    def emit(self, record: SpanRecord):
+        attrs = " ".join(f"{key}={value}" for key, value in record.attrs.items())
+        logger.log(self.level, f"{record.name}: {record.duration_s * 1000:.1f} ms {attrs}".rstrip())
+
+
+class JsonlSink:
+    """
+    Appends every span as one JSON line.
+
+    Args:
+      path (str): Output file, created with its directory if missing.
+    """
+    def __init__(self, path: str = METRICS_JSONL_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, record: SpanRecord):
+        line = json.dumps(asdict(record), ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+# ------------------------------
+# 2) Registry
+# ------------------------------
+def _percentile(sorted_values: Sequence[float], q: float) -> float:
+    # nearest rank
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+class Metrics:
+    """
+    Process-wide registry of spans and counters.
+
+    Args:
+      window (int): Recent durations kept per stage for the percentiles.
+      sinks (list): Objects with an `emit(SpanRecord)` method.
+    """
+    def __init__(self, window: int = METRICS_WINDOW, sinks: Optional[List] = None):
+        self.window = window
+        self.sinks = list(sinks or [])
+        self._durations: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._totals: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def observe(self, name: str, duration_s: float, **attrs) -> SpanRecord:
+        """
+        Records a finished stage and sends it to the sinks.
+
+        Args:
+          name (str): Stage name (e.g. "bigquery", "gemini").
+          duration_s (float): How long the stage took.
+          **attrs: Details of the stage. Numeric ones are summed into counters.
+        """
+        record = SpanRecord(name, time.time() - duration_s, duration_s, attrs)
+        with self._lock:
+            self._durations.setdefault(name, deque(maxlen=self.window)).append(duration_s)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._totals[(name, "seconds")] = self._totals.get((name, "seconds"), 0.0) + duration_s
+            for key, value in attrs.items():
+                if isinstance(value, (int, float)):
+                    self._totals[(name, key)] = self._totals.get((name, key), 0) + value
+        for sink in self.sinks:
+            try:
+                sink.emit(record)
+            except Exception as e:
+                logger.warning(f"Falha ao enviar métrica para {type(sink).__name__}: {e}")
+        return record
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[dict]:
+        """
+        Times the block and records it as `name`. The yielded dict takes the
+        attributes known only inside the block; an exception adds error=1.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException:
+            attrs["error"] = 1
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **attrs)
+
+    def recent(self) -> Dict[str, tuple]:
+        """
+        Returns {stage: (count, sorted recent durations)}.
+        """
+        with self._lock:
+            return {name: (self._counts[name], sorted(values)) for name, values in self._durations.items()}
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Returns {stage: {"count", "p50_ms", "p95_ms"}} over the recent durations.
+        """
+        return {
+            name: {
+                "count": count,
+                "p50_ms": round(_percentile(values, 50) * 1000, 1),
+                "p95_ms": round(_percentile(values, 95) * 1000, 1),
+            }
+            for name, (count, values) in sorted(self.recent().items())
+        }
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the counters as {stage: {attribute: sum}}; "seconds" is the total duration.
+        """
+        with self._lock:
+            items = list(self._totals.items())
+        totals: Dict[str, Dict[str, float]] = {}
+        for (name, key), value in items:
+            totals.setdefault(name, {})[key] = value
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+            self._totals.clear()
+
+
+# ------------------------------
+# 3) Prometheus text endpoint
+# ------------------------------
+def _metric_name(*parts: str) -> str:
+    return _METRIC_NAME.sub("_", "_".join((PROMETHEUS_PREFIX, *parts)))
+
+
+def prometheus_text(metrics: Metrics) -> str:
+    """
+    Renders the registry in the Prometheus text exposition format.
+    """
+    stage_seconds = _metric_name("stage_seconds")
+    lines = [f"# TYPE {stage_seconds} summary"]
+    totals = metrics.totals()
+    for name, (count, values) in sorted(metrics.recent().items()):
+        for q in (50, 95):
+            lines.append(f'{stage_seconds}{{stage="{name}",quantile="{q / 100}"}} {_percentile(values, q):.6f}')
+        lines.append(f'{stage_seconds}_sum{{stage="{name}"}} {totals[name]["seconds"]:.6f}')
+        lines.append(f'{stage_seconds}_count{{stage="{name}"}} {count}')
+    for name, attrs in sorted(totals.items()):
+        for key, value in sorted(attrs.items()):
+            if key == "seconds":
+                continue
+            counter = _metric_name(name, key, "total")
+            lines += [f"# TYPE {counter} counter", f"{counter} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def serve_prometheus(metrics: Metrics, port: int = METRICS_PROMETHEUS_PORT,
+                     host: str = "0.0.0.0") -> "ThreadingHTTPServer":
+    """
+    Serves prometheus_text(metrics) at http://host:port/metrics on a daemon thread.
+    """
+    # Imported here so that instrumented modules stay cheap to import
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text(metrics).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes are not worth a log line each
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Métricas Prometheus em http://{host}:{server.server_port}/metrics")
+    return server
+
+
+# ------------------------------
+# 4) Default registry
+# ------------------------------
+_default_metrics: Optional[Metrics] = None
+_default_metrics_lock = threading.Lock()
+
+
+def _sinks_from_settings() -> list:
+    sinks = []
+    for name in filter(None, (part.strip() for part in METRICS_SINKS.split(","))):
+        if name == "log":
+            sinks.append(LogSink())
+        elif name == "jsonl":
+            sinks.append(JsonlSink())
+        else:
+            logger.warning(f"Sink de métricas desconhecido: {name!r}")
+    return sinks
+
+
+def get_default_metrics() -> Metrics:
+    """
+    Returns the process-wide registry, with the sinks of METRICS_SINKS and, when
+    METRICS_PROMETHEUS_PORT is set, the Prometheus endpoint started.
+    """
+    global _default_metrics
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics(sinks=_sinks_from_settings())
+            if METRICS_PROMETHEUS_PORT:
+                try:
+                    serve_prometheus(_default_metrics)
+                except OSError as e:
+                    # e.g. another process (or Streamlit rerun) already holds the port
+                    logger.warning(f"Endpoint de métricas não iniciado: {e}")
+        return _default_metrics
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Compact encoding of the cluster payloads sent to Gemini.
+Only the fields the prompt rules use are sent, nulls are dropped, keys follow the
+short names documented in SYSTEM_INSTRUCTION and multi-row requests can use a
+columnar form. Prompts are measured before sending and held to a token budget.
+"""
+import json
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from typing import Any, Dict, List, Optional, Sequence
+
+from config.settings import PROMPT_TOKEN_BUDGET
+
+# Rough ratio used to size prompts before calling the API (no network round trip).
+CHARS_PER_TOKEN = 4
+
+# Cluster table column -> key documented in SYSTEM_INSTRUCTION. Other columns
+# (e.g. 'additional_notes', 'updated_at') are not sent.
+PROMPT_FIELDS = {
+    "cluster_id": "cluster_id",
+    "content_interest": "interest",
+    "location": "location",
+    "previous_engagement": "prev_engagement",
+    "is_subscriber": "subscriber",
+    "device_type": "device_type",
+    "access_time": "access_time",
+    "avg_daily_minutes": "avg_time_day",
+    "age": "age",
+    "last_access": "last_access",
+}
+
+# Fields needed to write the copy when canal/horario/oferta are already decided.
+COPY_PROMPT_FIELDS = {
+    "cluster_id": "cluster_id",
+    "content_interest": "interest",
+    "is_subscriber": "subscriber",
+    "age": "age",
+    "canal": "canal",
+    "oferta": "oferta",
+}
+
+
+class PromptBudgetError(ValueError):
+    """
+    Raised when a prompt is larger than the token budget of a request.
+    """
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text without calling the API.
+
+    Args:
+      text (str): Text that will be sent to the model.
+
+    Returns:
+      int: Approximate number of tokens.
+    """
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def check_budget(prompt: str, token_budget: int = PROMPT_TOKEN_BUDGET) -> int:
+    """
+    Returns the estimated tokens of a prompt, or raises if it exceeds the budget.
+
+    Raises:
+      PromptBudgetError: If the prompt is larger than `token_budget`.
+    """
+    tokens = estimate_tokens(prompt)
+    if token_budget and tokens > token_budget:
+        raise PromptBudgetError(f"O prompt tem ~{tokens} tokens, acima do limite de {token_budget}.")
+    return tokens
+
+
+def to_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str, separators=(",", ":"))
+
+
+def _compact_value(value: Any) -> Any:
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        value = value.item()  # numpy scalars
+    if isinstance(value, float):
+        return round(value, 1)
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="minutes")
+    if isinstance(value, time):
+        return value.strftime("%H:%M")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _is_null(value: Any) -> bool:
+    if value is None or isinstance(value, str):
+        return not value
+    try:
+        return bool(value != value)  # NaN, NaT
+    except TypeError:
+        return True  # pd.NA
+
+
+def encode_row(row: dict, fields: Dict[str, str] = PROMPT_FIELDS) -> dict:
+    """
+    Keeps the prompt fields of a cluster, without nulls, under their short keys.
+    """
+    return {
+        key: _compact_value(row[column])
+        for column, key in fields.items()
+        if column in row and not _is_null(row[column])
+    }
+
+
+def encode_rows(rows: Sequence[dict], fields: Dict[str, str] = PROMPT_FIELDS, tabular: bool = False) -> dict:
+    """
+    Encodes several clusters as {"rows": [...]} or, in the tabular form, as
+    {"cols": [...], "rows": [[...], ...]} with the keys written once.
+
+    Args:
+      rows (Sequence[dict]): Cluster dictionaries.
+      fields (dict): Column -> prompt key of the fields to send.
+      tabular (bool): Use the columnar form (for multi-row requests).
+    """
+    encoded = [encode_row(row, fields) for row in rows]
+    if not tabular:
+        return {"rows": encoded}
+    cols = [key for key in fields.values() if any(key in row for row in encoded)]
+    return {"cols": cols, "rows": [[row.get(key) for key in cols] for row in encoded]}
+
+
+@dataclass
+class EncodingStats:
+    """
+    Prompt tokens of the encoded payloads versus the plain `json.dumps` of the rows.
+    """
+    rows: int = 0
+    raw_tokens: int = 0
+    encoded_tokens: int = 0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def record(self, rows: Sequence[dict], encoded_payload: Any):
+        raw = sum(estimate_tokens(json.dumps(row, ensure_ascii=False, default=str)) for row in rows)
+        encoded = estimate_tokens(to_json(encoded_payload))
+        with self._lock:
+            self.rows += len(rows)
+            self.raw_tokens += raw
+            self.encoded_tokens += encoded
+
+    @property
+    def saved_per_row(self) -> float:
+        return (self.raw_tokens - self.encoded_tokens) / self.rows if self.rows else 0.0
+
+
+encoding_stats = EncodingStats()
+
+
+def encode_for_prompt(rows: List[dict], fields: Dict[str, str] = PROMPT_FIELDS, tabular: bool = False,
+                      extra: Optional[dict] = None) -> str:
+    """
+    Encodes the rows of a multi-row prompt and records the tokens saved.
+
+    Args:
+      rows (List[dict]): Cluster dictionaries.
+      fields (dict): Column -> prompt key of the fields to send.
+      tabular (bool): Use the columnar form.
+      extra (dict): Other top-level keys of the payload (e.g. "tz").
+    """
+    payload = {**encode_rows(rows, fields, tabular), **(extra or {})}
+    encoding_stats.record(rows, payload)
+    return to_json(payload)
+
+
+def encode_cluster(row: dict, fields: Dict[str, str] = PROMPT_FIELDS) -> str:
+    """
+    Encodes a single cluster for a prompt and records the tokens saved.
+    """
+    encoded = encode_row(row, fields)
+    encoding_stats.record([row], encoded)
+    return to_json(encoded)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Request and token rate limiting of the Gemini calls.
+A RateLimiter is made current for the calls of a run (see `limited`), and every
+request sent by gemini_service._generate is charged to it, repairs and tier
+escalations included.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_minute`.
+
+    Args:
+      rate_per_minute (float): Units (requests or tokens) allowed per minute.
+      capacity (float): Maximum burst. Defaults to one minute of rate.
+      clock (Callable): Monotonic clock, injectable for tests.
+      sleep (Callable): Wait function, injectable for tests.
+    """
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else float(rate_per_minute)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    def acquire(self, amount: float = 1.0):
+        """
+        Blocks until `amount` units are available and consumes them.
+        Requests larger than the capacity are clamped so they can still go through.
+        """
+        amount = min(amount, self.capacity)
+        # Held while waiting, so callers are served in order
+        with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                self._sleep((amount - self._tokens) / self.rate_per_second)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budget of an API key.
+
+    Args:
+      requests_per_minute (float): Request rate limit.
+      tokens_per_minute (float): Token rate limit (prompt + output), or None to disable it.
+    """
+    def __init__(self, requests_per_minute: float, tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens: float):
+        """
+        Waits for one request and `tokens` tokens of the budget.
+        """
+        self.requests.acquire()
+        if self.tokens is not None:
+            self.tokens.acquire(tokens)
+
+
+_current_limiter: ContextVar[Optional[RateLimiter]] = ContextVar("rate_limiter", default=None)
+
+
+def current_limiter() -> Optional[RateLimiter]:
+    """
+    Returns the limiter of the running calls, or None when they are not limited.
+    """
+    return _current_limiter.get()
+
+
+@contextmanager
+def limited(limiter: Optional[RateLimiter]) -> Iterator[Optional[RateLimiter]]:
+    """
+    Makes `limiter` current for the calls made in the block.
+    """
+    token = _current_limiter.set(limiter)
+    try:
+        yield limiter
+    finally:
+        _current_limiter.reset(token)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent store of the generated campaigns.
+Every generation is kept as a new version, indexed by cluster_id, model, prompt
+hash and time, so past suggestions can be looked up without calling Gemini again.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Sequence
+
+from config.settings import RESULT_STORE_PATH
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StoredResult:
+    id: int
+    cluster_id: str
+    model: str
+    prompt_hash: str
+    created_at: float
+    user_notes: str
+    suggestion: dict
+
+
+_COLUMNS = "id, cluster_id, model, prompt_hash, created_at, user_notes, suggestion"
+
+
+def _export_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.int64()), ("cluster_id", pa.string()), ("model", pa.string()), ("prompt_hash", pa.string()),
+        ("created_at", pa.timestamp("us", tz="UTC")), ("user_notes", pa.string()),
+        ("suggestion", pa.string()),  # JSON
+    ])
+
+
+def _to_result(row) -> StoredResult:
+    return StoredResult(*row[:6], suggestion=json.loads(row[6]))
+
+
+class ResultStore:
+    """
+    SQLite table of campaign versions (append-only).
+
+    Args:
+      path (str): SQLite file. ":memory:" keeps the store in the process only.
+    """
+    def __init__(self, path: str = RESULT_STORE_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS campaign_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cluster_id TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                user_notes TEXT NOT NULL,
+                suggestion TEXT NOT NULL
+            )
+            """
+        )
+        # id grows with created_at, so (cluster_id, id) also orders versions in time
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_cluster ON campaign_results (cluster_id, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_prompt ON campaign_results (prompt_hash, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_model ON campaign_results (model, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_created ON campaign_results (created_at)")
+        self._conn.commit()
+
+    def add(self, cluster_id: str, suggestion: dict, model: str, prompt_hash: str, user_notes: str = "") -> int:
+        """
+        Stores a new version of the campaign of a cluster.
+
+        Returns:
+          int: The id of the version.
+        """
+        return self.add_many([(cluster_id, suggestion, model, prompt_hash, user_notes)])[0]
+
+    def add_many(self, records: Iterable[tuple]) -> List[int]:
+        """
+        Stores several versions in one transaction.
+
+        Args:
+          records: (cluster_id, suggestion, model, prompt_hash, user_notes) tuples.
+        """
+        now = time.time()
+        ids = []
+        with self._lock:
+            for cluster_id, suggestion, model, prompt_hash, user_notes in records:
+                cursor = self._conn.execute(
+                    "INSERT INTO campaign_results (cluster_id, model, prompt_hash, created_at, user_notes, suggestion) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (str(cluster_id), model, prompt_hash, now, user_notes or "",
+                     json.dumps(suggestion, ensure_ascii=False, default=str)),
+                )
+                ids.append(cursor.lastrowid)
+            self._conn.commit()
+        return ids
+
+    def latest(self, cluster_id: str, model: Optional[str] = None,
+               prompt_hash: Optional[str] = None) -> Optional[StoredResult]:
+        """
+        Returns the most recent version for a cluster, optionally of a given model
+        or exact prompt, or None.
+        """
+        query = f"SELECT {_COLUMNS} FROM campaign_results WHERE cluster_id = ?"
+        params: list = [str(cluster_id)]
+        if model is not None:
+            query += " AND model = ?"
+            params.append(model)
+        if prompt_hash is not None:
+            query += " AND prompt_hash = ?"
+            params.append(prompt_hash)
+        with self._lock:
+            row = self._conn.execute(query + " ORDER BY id DESC LIMIT 1", params).fetchone()
+        return _to_result(row) if row else None
+
+    def history(self, cluster_id: str, limit: int = 20) -> List[StoredResult]:
+        """
+        Returns the versions of a cluster, newest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM campaign_results WHERE cluster_id = ? ORDER BY id DESC LIMIT ?",
+                (str(cluster_id), limit),
+            ).fetchall()
+        return [_to_result(row) for row in rows]
+
+    def latest_per_cluster(self, cluster_ids: Optional[Sequence[str]] = None) -> List[StoredResult]:
+        """
+        Returns the latest version of every cluster (or of the given clusters).
+        """
+        latest_ids = "SELECT MAX(id) FROM campaign_results {where} GROUP BY cluster_id"
+        with self._lock:
+            if cluster_ids is None:
+                rows = self._conn.execute(
+                    f"SELECT {_COLUMNS} FROM campaign_results WHERE id IN ({latest_ids.format(where='')})"
+                    " ORDER BY cluster_id"
+                ).fetchall()
+            else:
+                # in chunks, below SQLite's limit of bound parameters
+                ids, rows = [str(cluster_id) for cluster_id in cluster_ids], []
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    where = f"WHERE cluster_id IN ({', '.join('?' * len(chunk))})"
+                    rows += self._conn.execute(
+                        f"SELECT {_COLUMNS} FROM campaign_results WHERE id IN ({latest_ids.format(where=where)})",
+                        chunk,
+                    ).fetchall()
+        return [_to_result(row) for row in rows]
+
+    def export_parquet(self, path: str, latest_only: bool = False, since: Optional[float] = None) -> int:
+        """
+        Writes the versions (or only the latest per cluster) to a Parquet file.
+
+        Args:
+          path (str): Output file.
+          latest_only (bool): Keep only the latest version of each cluster.
+          since (float): Only versions created at or after this epoch time.
+
+        Returns:
+          int: Rows written.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        query = f"SELECT {_COLUMNS} FROM campaign_results"
+        conditions, params = [], []
+        if latest_only:
+            conditions.append("id IN (SELECT MAX(id) FROM campaign_results GROUP BY cluster_id)")
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id", params).fetchall()
+
+        schema = _export_schema()
+        table = pa.Table.from_pylist([
+            {**dict(zip(schema.names, row)), "created_at": datetime.fromtimestamp(row[4], timezone.utc)}
+            for row in rows
+        ], schema=schema)
+        pq.write_table(table, path)
+        logger.info(f"{len(rows)} campanhas exportadas para {path}.")
+        return len(rows)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM campaign_results").fetchone()[0]
+
+
+_default_store: Optional[ResultStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store() -> ResultStore:
+    """
+    Returns the process-wide store at RESULT_STORE_PATH.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ResultStore()
+        return _default_store
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic rules of SYSTEM_INSTRUCTION for 'canal', 'horario' and 'oferta'.
+They are computed for every row of the cluster DataFrame at once, so the model is
+only asked to write the 'mensagem' copy around them.
+"""
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+# Age bands of the prompt rules: 18–24, 25–44, 45–64, 65+.
+AGE_BAND_EDGES = [25, 45, 65]
+
+# 3) HORÁRIO: first default of each age band, when there is no peak hour.
+DEFAULT_HORARIO_BY_AGE_BAND = ["12:45", "12:45", "10:45", "09:30"]
+
+# 3) HORÁRIO: window used when neither the peak hour nor the age is known.
+AMBIGUOUS_HORARIO = "10h ou 14h"
+
+# 4) OFERTA: (interest, is_subscriber) -> offer. Other interests use FALLBACK_OFFERS.
+OFFERS = {
+    ("esportes", False): "7 dias grátis do streaming esportivo",
+    ("noticias", False): "Acesso gratuito por 24h a conteúdos premium",
+    ("receitas", False): "Coleção/ebook da semana",
+    ("esportes", True): "Conteúdo exclusivo",
+    ("noticias", True): "Série especial",
+    ("receitas", True): "Cardápio da semana",
+}
+FALLBACK_OFFERS = {False: "Teste gratuito", True: "Benefício de fidelidade"}
+
+
+def _on_uniques(series: pd.Series, func) -> pd.Series:
+    # Columns have few distinct values: transform those and broadcast them back
+    codes, uniques = pd.factorize(series)
+    values = func(pd.Series(uniques, dtype="object")).to_numpy(dtype=object)
+    result = np.full(len(series), None, dtype=object)
+    result[codes >= 0] = values[codes[codes >= 0]]
+    return pd.Series(result, index=series.index)
+
+
+def _normalized(series: pd.Series) -> pd.Series:
+    """
+    Lower case without accents, so "Notícias" and "noticias" match the same rule.
+    Returned as a categorical, so the comparisons below don't loop over strings.
+    """
+    codes, uniques = pd.factorize(series)
+    normalized = (pd.Series(uniques, dtype="object").astype("string").str.strip().str.lower()
+                  .str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii"))
+    merged, categories = pd.factorize(normalized)
+    merged = np.append(merged, -1)  # code -1 (missing) stays missing
+    return pd.Series(pd.Categorical.from_codes(merged[codes], categories), index=series.index)
+
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    return df[name] if name in df.columns else pd.Series(pd.NA, index=df.index, dtype="object")
+
+
+def _as_bool(series: pd.Series) -> pd.Series:
+    text = _normalized(series)
+    return text.isin(["true", "1", "sim", "yes"])
+
+
+def peak_hour(access_time: pd.Series) -> pd.Series:
+    """
+    Extracts the hour of 'access_time' values ("19:08:00", "2025-08-20T19:08:00-03:00",
+    datetime.time or timestamps), as written, i.e. without timezone conversion.
+
+    Returns:
+      pd.Series: Float hours, NaN where there is no hour.
+    """
+    hours = _on_uniques(access_time, lambda values: pd.to_numeric(
+        values.astype("string").str.extract(r"(?:^|[T\s])(\d{1,2}):\d{2}", expand=False), errors="coerce"
+    ))
+    hours = pd.to_numeric(hours, errors="coerce")
+    return hours.where(hours < 24)
+
+
+def age_band(age: pd.Series) -> pd.Series:
+    """
+    Index of the age band of each row (0: 18–24, 1: 25–44, 2: 45–64, 3: 65+), -1 if unknown.
+    """
+    ages = pd.to_numeric(age, errors="coerce")
+    bands = pd.Series(np.searchsorted(AGE_BAND_EDGES, ages.fillna(0).to_numpy(), side="right"), index=age.index)
+    return bands.where(ages.notna(), -1).astype(int)
+
+
+def compute_channel(df: pd.DataFrame) -> pd.Series:
+    """
+    2) CANAL: the previous engagement decides; otherwise mobile + 18–44 → Push and
+    45+ → Email. The remaining ambiguous rows default to Email.
+    """
+    engagement = _normalized(_column(df, "previous_engagement"))
+    mobile = _normalized(_column(df, "device_type")).eq("mobile").to_numpy(dtype=bool)
+    band = age_band(_column(df, "age")).to_numpy()
+    channel = np.select(
+        [
+            engagement.eq("push").to_numpy(dtype=bool),
+            engagement.eq("email").to_numpy(dtype=bool),
+            mobile & np.isin(band, [0, 1]),
+        ],
+        ["Push", "Email", "Push"],
+        default="Email",
+    )
+    return pd.Series(channel, index=df.index)
+
+
+def compute_send_time(df: pd.DataFrame) -> pd.Series:
+    """
+    3) HORÁRIO: "H:45" for the peak hour H; otherwise the default of the age band;
+    otherwise the "10h ou 14h" window.
+    """
+    hours = peak_hour(_column(df, "access_time"))
+    band = age_band(_column(df, "age")).to_numpy()
+    by_peak = np.array([f"{hour:02d}:45" for hour in range(24)], dtype=object)[hours.fillna(0).astype(int)]
+    by_age = np.array(DEFAULT_HORARIO_BY_AGE_BAND + [AMBIGUOUS_HORARIO], dtype=object)[band]
+    return pd.Series(np.where(hours.notna().to_numpy(), by_peak, by_age), index=df.index)
+
+
+def compute_offer(df: pd.DataFrame) -> pd.Series:
+    """
+    4) OFERTA: by interest and subscriber status, see OFFERS.
+    """
+    interest = _normalized(_column(df, "content_interest")).cat
+    subscriber = _as_bool(_column(df, "is_subscriber")).to_numpy(dtype=int)
+    # one row per interest category (plus one for missing), one column per status
+    table = np.array([
+        [OFFERS.get((category, is_subscriber), FALLBACK_OFFERS[is_subscriber]) for is_subscriber in (False, True)]
+        for category in [*interest.categories, None]
+    ], dtype=object)
+    return pd.Series(table[interest.codes, subscriber], index=df.index)
+
+
+def apply_rules(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes 'canal', 'horario' and 'oferta' for every cluster.
+
+    Args:
+      df (pd.DataFrame): Cluster rows with the columns of the cluster table.
+
+    Returns:
+      pd.DataFrame: 'cluster_id', 'canal', 'horario' and 'oferta', one row per input row.
+    """
+    return pd.DataFrame({
+        "cluster_id": _column(df, "cluster_id").astype(str),
+        "canal": compute_channel(df),
+        "horario": compute_send_time(df),
+        "oferta": compute_offer(df),
+    }, index=df.index)
+
+
+def rule_plan(rows: List[dict]) -> Dict[str, dict]:
+    """
+    Same as apply_rules for a list of cluster dictionaries, keyed by cluster_id.
+    """
+    if not rows:
+        return {}
+    plan = apply_rules(pd.DataFrame(rows))
+    return {record.pop("cluster_id"): record for record in plan.to_dict("records")}
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Sharded campaign generation: a coordinator fills a durable work queue and any
+number of worker processes (on this or other hosts) drain it.
+
+The queue is a SQLite file. Workers lease items for a visibility timeout; an item
+whose worker dies is leased again once its lease expires. Results are committed in
+the queue itself, and only the first commit of an item counts, so an item that
+was processed twice is still stored once.
+
+Note: SQLite locking needs a filesystem with working POSIX locks; on network
+filesystems prefer a local disk per host or a single shared host.
+
+Usage:
+  python -m services.shard_service enqueue --queue work.sqlite --input clusters.parquet --notes "..."
+  python -m services.shard_service work --queue work.sqlite --worker-id host-a-1
+  python -m services.shard_service status --queue work.sqlite
+  python -m services.shard_service export --queue work.sqlite --output campaigns.jsonl
+  python -m services.shard_service run-local --queue work.sqlite --workers 4 --fake-model
+  python -m services.shard_service run-local --queue work.sqlite --workers 2 --api-key-env KEY_A,KEY_B
+
+With run-local, the workers take the keys of --api-key-env in turn, and the
+workers that share a key split its --rpm/--tpm quota.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from config.settings import (
+    GEMINI_CONCURRENCY, GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE, MODEL_GEMINI, SHARD_LEASE_BATCH,
+    SHARD_MAX_ATTEMPTS, SHARD_VISIBILITY_TIMEOUT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+PENDING, LEASED, DONE, FAILED = "pending", "leased", "done", "failed"
+
+
+# ------------------------------
+# 1) Durable work queue
+# ------------------------------
+@dataclass
+class WorkItem:
+    cluster_id: str
+    row: dict
+    attempts: int
+
+
+class WorkQueue:
+    """
+    SQLite work queue of clusters with leases and visibility timeouts.
+
+    Every process opens its own WorkQueue on the same file. Leasing runs in a
+    write transaction, so two workers never hold a valid lease on the same item.
+
+    Args:
+      path (str): SQLite file shared by the coordinator and the workers.
+      max_attempts (int): Leases an item gets before it is marked as failed.
+    """
+    def __init__(self, path: str, max_attempts: int = SHARD_MAX_ATTEMPTS):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_attempts = max_attempts
+        # autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=60000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                cluster_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                completed_by TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_items_status ON items (status, lease_expires_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _write(self):
+        return _Transaction(self._conn)
+
+    def set_meta(self, values: Dict[str, str]):
+        with self._write():
+            self._conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", list(values.items()))
+
+    def meta(self) -> Dict[str, str]:
+        return dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+
+    def enqueue(self, rows: Iterable[dict], batch_size: int = 1000) -> int:
+        """
+        Adds clusters to the queue. Clusters already queued are left untouched, so
+        enqueueing the same source twice is harmless.
+
+        Returns:
+          int: Number of clusters added.
+        """
+        added, batch = 0, []
+
+        def flush():
+            nonlocal added
+            with self._write():
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO items (cluster_id, payload, status, updated_at) VALUES (?, ?, ?, ?)",
+                    batch,
+                )
+                added += self._conn.total_changes - before
+            batch.clear()
+
+        for row in rows:
+            batch.append((str(row["cluster_id"]), json.dumps(row, ensure_ascii=False, default=str), PENDING, time.time()))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        return added
+
+    def lease(self, worker_id: str, limit: int, visibility_timeout: float) -> List[WorkItem]:
+        """
+        Leases up to `limit` pending (or expired) items for `visibility_timeout` seconds.
+        """
+        now = time.time()
+        with self._write():
+            # Items whose lease expired too many times are given up
+            self._conn.execute(
+                "UPDATE items SET status = ?, error = ?, updated_at = ? "
+                "WHERE status = ? AND lease_expires_at < ? AND attempts >= ?",
+                (FAILED, "lease expirado muitas vezes", now, LEASED, now, self.max_attempts),
+            )
+            rows = self._conn.execute(
+                "SELECT cluster_id, payload, attempts FROM items "
+                "WHERE status = ? OR (status = ? AND lease_expires_at < ?) LIMIT ?",
+                (PENDING, LEASED, now, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE items SET status = ?, lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE cluster_id = ?",
+                [(LEASED, worker_id, now + visibility_timeout, now, cluster_id) for cluster_id, _, _ in rows],
+            )
+        return [WorkItem(cluster_id, json.loads(payload), attempts + 1) for cluster_id, payload, attempts in rows]
+
+    def extend(self, worker_id: str, cluster_ids: List[str], visibility_timeout: float):
+        """
+        Extends the leases this worker still holds (heartbeat).
+        """
+        if not cluster_ids:
+            return
+        now = time.time()
+        with self._write():
+            self._conn.executemany(
+                "UPDATE items SET lease_expires_at = ? WHERE cluster_id = ? AND status = ? AND lease_owner = ?",
+                [(now + visibility_timeout, cluster_id, LEASED, worker_id) for cluster_id in cluster_ids],
+            )
+
+    def complete(self, cluster_id: str, worker_id: str, result: str) -> bool:
+        """
+        Stores the result of an item. Only the first commit counts.
+
+        Returns:
+          bool: False if the item was already done (e.g. by a worker whose lease expired).
+        """
+        with self._write():
+            cursor = self._conn.execute(
+                "UPDATE items SET status = ?, result = ?, error = NULL, completed_by = ?, lease_owner = NULL, "
+                "updated_at = ? WHERE cluster_id = ? AND status != ?",
+                (DONE, result, worker_id, time.time(), cluster_id, DONE),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, cluster_id: str, worker_id: str, error: str):
+        """
+        Releases an item after an error: back to pending, or failed after max_attempts.
+        """
+        with self._write():
+            self._conn.execute(
+                "UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, "
+                "lease_owner = NULL, lease_expires_at = NULL, updated_at = ? "
+                "WHERE cluster_id = ? AND status = ? AND lease_owner = ?",
+                (self.max_attempts, FAILED, PENDING, error, time.time(), cluster_id, LEASED, worker_id),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(self._conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+        return counts
+
+    def results(self) -> Iterator[dict]:
+        """
+        Yields the finished items as output records.
+        """
+        cursor = self._conn.execute(
+            "SELECT cluster_id, result, completed_by, updated_at FROM items WHERE status = ? ORDER BY cluster_id", (DONE,)
+        )
+        for cluster_id, result, completed_by, updated_at in cursor:
+            yield {"cluster_id": cluster_id, "worker": completed_by, "completed_at": updated_at,
+                   "suggestion": json.loads(result)}
+
+    def close(self):
+        self._conn.close()
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self._conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+# ------------------------------
+# 2) Worker
+# ------------------------------
+def run_worker(queue_path: str, worker_id: str, api_key: Optional[str], model=None,
+               lease_batch: int = SHARD_LEASE_BATCH,
+               visibility_timeout: float = SHARD_VISIBILITY_TIMEOUT_SECONDS,
+               idle_poll_s: float = 2.0, cache=None, **limits) -> Dict[str, int]:
+    """
+    Leases clusters until the queue is drained and generates their campaigns.
+
+    Each leased batch goes through the concurrent runner; every finished cluster
+    is committed right away and extends the leases of the rest of the batch.
+
+    Args:
+      queue_path (str): SQLite file of the WorkQueue.
+      worker_id (str): Unique name of this worker (stored with its results).
+      api_key (str): The Gemini API key of this worker.
+      model: Optional model (e.g. a FakeGenerativeModel).
+      lease_batch (int): Clusters leased at a time.
+      visibility_timeout (float): Seconds before an unfinished lease is handed out again.
+      idle_poll_s (float): Wait when other workers still hold leases.
+      cache: Optional SuggestionCache.
+      **limits: Forwarded to the concurrent runner (concurrency, requests_per_minute...).
+
+    Returns:
+      Dict[str, int]: Clusters completed, duplicated (already done by another
+      worker) and failed by this worker.
+    """
+    from services.gemini_runner import ClusterResult, iter_results
+    from services.gemini_service import suggest_campaign_from_cluster
+    from services.rate_limit import RateLimiter
+
+    queue = WorkQueue(queue_path)
+    meta = queue.meta()
+    user_notes, model_name = meta.get("user_notes", ""), meta.get("model_name", MODEL_GEMINI)
+    report = {"done": 0, "duplicates": 0, "failed": 0}
+    # One budget for the whole worker: each leased batch runs on a new event loop,
+    # and new buckets would start full every time
+    limiter = RateLimiter(limits.pop("requests_per_minute", GEMINI_REQUESTS_PER_MINUTE),
+                          limits.pop("tokens_per_minute", GEMINI_TOKENS_PER_MINUTE))
+
+    def call(row: dict) -> dict:
+        return suggest_campaign_from_cluster(row, user_notes, api_key=api_key, model=model, cache=cache,
+                                             model_name=model_name)
+
+    async def run_batch(items: List[WorkItem]):
+        remaining = {item.cluster_id for item in items}
+        async for outcome in iter_results([item.row for item in items], call, limiter=limiter, **limits):
+            outcome: ClusterResult
+            remaining.discard(outcome.cluster_id)
+            if outcome.ok:
+                stored = queue.complete(outcome.cluster_id, worker_id, json.dumps(outcome.result, ensure_ascii=False))
+                report["done" if stored else "duplicates"] += 1
+            else:
+                queue.fail(outcome.cluster_id, worker_id, str(outcome.error))
+                report["failed"] += 1
+            queue.extend(worker_id, list(remaining), visibility_timeout)
+
+    try:
+        while True:
+            items = queue.lease(worker_id, lease_batch, visibility_timeout)
+            if items:
+                asyncio.run(run_batch(items))
+                continue
+            counts = queue.counts()
+            if counts[PENDING] == 0 and counts[LEASED] == 0:
+                break
+            # Other workers hold leases; take over if they expire
+            time.sleep(idle_poll_s)
+    finally:
+        queue.close()
+    logger.info(f"Worker {worker_id}: {report}")
+    return report
+
+
+def _worker_process(queue_path: str, worker_id: str, api_key_env: str, fake_model: bool, limits: dict):
+    logging.basicConfig(level=logging.INFO)
+    model = None
+    if fake_model:
+        from services.fake_gemini import FakeGenerativeModel
+        model = FakeGenerativeModel(latency_s=0.05, jitter_s=0.05)
+    run_worker(queue_path, worker_id, os.environ.get(api_key_env), model=model, **limits)
+
+
+# ------------------------------
+# 3) Command line
+# ------------------------------
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="add clusters to the queue")
+    enqueue.add_argument("--queue", required=True)
+    source = enqueue.add_mutually_exclusive_group(required=True)
+    source.add_argument("--table", help="BigQuery table as PROJECT.DATASET.TABLE")
+    source.add_argument("--input", help="local .jsonl, .csv or .parquet file")
+    enqueue.add_argument("--filter", action="append", help="COLUMN=V1,V2 (BigQuery source only)")
+    enqueue.add_argument("--notes", default="", help="business/campaign objective")
+    enqueue.add_argument("--model", default=MODEL_GEMINI)
+
+    for name, help_text in (("work", "run one worker"), ("run-local", "run N local worker processes")):
+        worker = commands.add_parser(name, help=help_text)
+        worker.add_argument("--queue", required=True)
+        worker.add_argument("--api-key-env", default="GEMINI_API_KEY",
+                            help="variable holding this worker's key" if name == "work"
+                            else "comma-separated variables holding the keys, used by the workers in turn")
+        worker.add_argument("--lease-batch", type=int, default=SHARD_LEASE_BATCH)
+        worker.add_argument("--visibility-timeout", type=float, default=SHARD_VISIBILITY_TIMEOUT_SECONDS)
+        worker.add_argument("--concurrency", type=int, default=GEMINI_CONCURRENCY)
+        worker.add_argument("--rpm", type=int, default=GEMINI_REQUESTS_PER_MINUTE, help="request quota per key")
+        worker.add_argument("--tpm", type=int, default=GEMINI_TOKENS_PER_MINUTE, help="token quota per key (0: off)")
+        worker.add_argument("--fake-model", action="store_true", help="use the local fake model (dry run)")
+        if name == "work":
+            worker.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}")
+        else:
+            worker.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+
+    status = commands.add_parser("status", help="count items per status")
+    status.add_argument("--queue", required=True)
+
+    export = commands.add_parser("export", help="write the finished campaigns as JSONL")
+    export.add_argument("--queue", required=True)
+    export.add_argument("--output", required=True)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "enqueue":
+        from services.batch_service import _parse_filters, iter_file_rows, iter_table_rows
+
+        queue = WorkQueue(args.queue)
+        queue.set_meta({"user_notes": args.notes, "model_name": args.model})
+        rows = iter_table_rows(args.table, _parse_filters(args.filter)) if args.table else iter_file_rows(args.input)
+        print(json.dumps({"added": queue.enqueue(rows), **queue.counts()}, indent=2))
+        return 0
+
+    if args.command in ("work", "run-local"):
+        key_envs = [name.strip() for name in args.api_key_env.split(",") if name.strip()]
+        if args.command == "work" and len(key_envs) != 1:
+            parser.error("--api-key-env deve ter uma única variável por worker.")
+        missing = [name for name in key_envs if not os.environ.get(name)]
+        if not args.fake_model and (missing or not key_envs):
+            parser.error(f"{', '.join(missing) or '--api-key-env'} não encontrada.")
+        limits = {
+            "lease_batch": args.lease_batch, "visibility_timeout": args.visibility_timeout,
+            "concurrency": args.concurrency, "requests_per_minute": args.rpm, "tokens_per_minute": args.tpm or None,
+        }
+        if args.command == "work":
+            _worker_process(args.queue, args.worker_id, key_envs[0], args.fake_model, limits)
+        else:
+            # Workers take the keys in turn; those on the same key split its quota
+            worker_keys = [key_envs[n % len(key_envs)] for n in range(args.workers)]
+            processes = []
+            context = multiprocessing.get_context("spawn")
+            for n, key_env in enumerate(worker_keys):
+                sharing = worker_keys.count(key_env)
+                worker_limits = {
+                    **limits,
+                    "requests_per_minute": args.rpm / sharing,
+                    "tokens_per_minute": args.tpm / sharing if args.tpm else None,
+                }
+                processes.append(context.Process(target=_worker_process, args=(
+                    args.queue, f"{socket.gethostname()}-local-{n}", key_env, args.fake_model, worker_limits
+                )))
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+
+    queue = WorkQueue(args.queue)
+    if args.command == "export":
+        with open(args.output, "w", encoding="utf-8") as f:
+            for record in queue.results():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    counts = queue.counts()
+    print(json.dumps(counts, indent=2))
+    return 0 if counts[FAILED] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Local Parquet snapshot of the cluster table.
+The snapshot is a Parquet file plus a manifest; it is memory-mapped at startup and
+refreshed incrementally with the rows changed since the stored watermark.
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from config.settings import SNAPSHOT_DIR, SNAPSHOT_WATERMARK_COLUMN
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+# A source receives the current watermark (None = full load) and returns the
+# rows changed after it as an Arrow table. It raises when the read fails.
+SnapshotSource = Callable[[Optional[Any]], pa.Table]
+
+
+def _fsync_write(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _encode_watermark(value: Any) -> Optional[Dict[str, Any]]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return {"value": value.isoformat(), "is_datetime": True}
+    return {"value": value, "is_datetime": False}
+
+
+def _decode_watermark(data: Optional[Dict[str, Any]]) -> Optional[Any]:
+    if not data:
+        return None
+    return datetime.fromisoformat(data["value"]) if data["is_datetime"] else data["value"]
+
+
+class SnapshotStore:
+    """
+    Parquet snapshot with a manifest, swapped atomically on every refresh.
+
+    Readers always open the file named by the current manifest; a refresh writes a
+    new file and then replaces the manifest with os.replace, so a reader never
+    sees a half-written snapshot.
+
+    Args:
+      directory (str): Where the Parquet files and the manifest live.
+      key_column (str): Column identifying a row, used to upsert changed rows.
+      watermark_column (str): Column with the change time of each row. Empty
+        means every refresh is a full reload.
+      keep_files (int): Snapshot files kept on disk, so that readers of the
+        previous version are not cut short.
+    """
+    def __init__(self, directory: str = SNAPSHOT_DIR, key_column: str = "cluster_id",
+                 watermark_column: str = SNAPSHOT_WATERMARK_COLUMN, keep_files: int = 2):
+        self.directory = directory
+        self.key_column = key_column
+        self.watermark_column = watermark_column
+        self.keep_files = keep_files
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def manifest(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns the current manifest, or None if there is no snapshot yet.
+        """
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @property
+    def watermark(self) -> Optional[Any]:
+        manifest = self.manifest()
+        return _decode_watermark(manifest.get("watermark")) if manifest else None
+
+    def age_seconds(self) -> Optional[float]:
+        """
+        Seconds since the last refresh, or None if there is no snapshot.
+        """
+        manifest = self.manifest()
+        return time.time() - manifest["refreshed_at"] if manifest else None
+
+    def load(self) -> Optional[pa.Table]:
+        """
+        Memory-maps the current snapshot, or returns None if there is none.
+        """
+        manifest = self.manifest()
+        if manifest is None:
+            return None
+        return pq.read_table(os.path.join(self.directory, manifest["file"]), memory_map=True)
+
+    def refresh(self, source: SnapshotSource, full: bool = False) -> pa.Table:
+        """
+        Pulls the rows changed since the watermark and swaps in the merged snapshot.
+
+        Rows deleted at the source are only dropped by a full refresh. If the source
+        fails, the snapshot and its refresh time are left as they are, so the next
+        call tries again.
+
+        Args:
+          source (SnapshotSource): Returns the rows changed after a watermark.
+          full (bool): Ignore the watermark and reload everything.
+
+        Returns:
+          pa.Table: The snapshot after the refresh (the one on disk, or an empty
+          table if there is none, when the source failed).
+        """
+        current = None if full else self.load()
+        watermark = self.watermark if current is not None and self.watermark_column else None
+        try:
+            changes = source(watermark)
+        except Exception as e:
+            logger.error(f"Snapshot não atualizado, falha ao ler a origem: {e}")
+            on_disk = current if current is not None else self.load()
+            return on_disk if on_disk is not None else pa.table({})
+        logger.info(f"Snapshot: {changes.num_rows} linhas alteradas desde {watermark}.")
+
+        if changes.num_rows == 0:
+            if current is not None:
+                # Nothing changed: keep the file, just record the refresh time.
+                self._write_manifest(self.manifest()["file"], current, watermark)
+                return current
+            # Empty source: keep whatever is on disk.
+            on_disk = self.load()
+            return on_disk if on_disk is not None else changes
+
+        merged = changes if current is None or watermark is None else self._upsert(current, changes)
+        return self._swap(merged)
+
+    def _upsert(self, current: pa.Table, changes: pa.Table) -> pa.Table:
+        changed_keys = changes.column(self.key_column).cast(current.schema.field(self.key_column).type)
+        kept = current.filter(pc.invert(pc.is_in(current.column(self.key_column), value_set=changed_keys)))
+        return pa.concat_tables([kept, changes.select(kept.column_names)], promote_options="permissive")
+
+    def _swap(self, table: pa.Table) -> pa.Table:
+        file_name = f"clusters-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp_path)
+            with open(tmp_path, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, os.path.join(self.directory, file_name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        watermark = None
+        if self.watermark_column and self.watermark_column in table.column_names and table.num_rows:
+            watermark = pc.max(table.column(self.watermark_column)).as_py()
+        self._write_manifest(file_name, table, watermark)
+        self._remove_old_files(file_name)
+        return self.load()
+
+    def _write_manifest(self, file_name: str, table: pa.Table, watermark: Optional[Any]):
+        manifest = {
+            "file": file_name,
+            "rows": table.num_rows,
+            "watermark": _encode_watermark(watermark),
+            "refreshed_at": time.time(),
+        }
+        tmp_path = f"{self.manifest_path}.{uuid.uuid4().hex[:8]}.tmp"
+        _fsync_write(tmp_path, json.dumps(manifest).encode("utf-8"))
+        os.replace(tmp_path, self.manifest_path)
+
+    def _mtime(self, file_name: str) -> float:
+        try:
+            return os.path.getmtime(os.path.join(self.directory, file_name))
+        except OSError:
+            return 0.0  # removed meanwhile (e.g. by another replica)
+
+    def _remove_old_files(self, current_file: str):
+        """
+        Deletes the oldest snapshot files beyond `keep_files`.
+
+        Replicas may share the directory and refresh at the same time, so the file
+        named by the manifest is never deleted, and the manifest is re-read right
+        before each deletion: another replica may have just pointed it elsewhere.
+        """
+        snapshots = sorted(
+            (f for f in os.listdir(self.directory) if f.startswith("clusters-") and f.endswith(".parquet")),
+            key=self._mtime,
+            reverse=True,
+        )
+        for old in [f for f in snapshots if f != current_file][self.keep_files - 1:]:
+            manifest = self.manifest()
+            if manifest is not None and manifest["file"] == old:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                pass
+
+
+def bigquery_source(table_project_id: str, dataset_id: str, table_id: str,
+                    columns: Optional[Sequence[str]] = None,
+                    watermark_column: str = SNAPSHOT_WATERMARK_COLUMN) -> SnapshotSource:
+    """
+    Builds a SnapshotSource that reads the changed rows from BigQuery.
+
+    The watermark column is only used if the table has it; otherwise every
+    refresh is a full reload.
+    """
+    from services.bq_service import get_marketing_clusters_arrow, get_table_columns
+
+    if watermark_column and watermark_column not in get_table_columns(table_project_id, dataset_id, table_id):
+        logger.warning(f"A tabela não tem a coluna {watermark_column!r}; o snapshot será recarregado por completo.")
+        watermark_column = ""
+
+    if columns is not None and watermark_column and watermark_column not in columns:
+        columns = [*columns, watermark_column]
+
+    def source(watermark: Optional[Any]) -> pa.Table:
+        changed_since = (watermark_column, watermark) if watermark is not None and watermark_column else None
+        return get_marketing_clusters_arrow(
+            table_project_id, dataset_id, table_id, columns=columns, changed_since=changed_since,
+            raise_errors=True,
+        )
+
+    return source
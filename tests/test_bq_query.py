@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, time, timezone
+
+import numpy as np
+import pytest
+
+from services.bq_service import QueryParam, build_clusters_query, table_ref
+
+TABLE = table_ref("project", "dataset", "clusters")
+
+
+def test_no_filters():
+    query, params = build_clusters_query(TABLE)
+    assert query == "SELECT *\nFROM `project.dataset.clusters`\nORDER BY cluster_id"
+    assert params == []
+
+
+def test_columns_and_limit():
+    query, _ = build_clusters_query(TABLE, columns=["cluster_id", "age"], limit=10, offset=20)
+    assert query.startswith("SELECT cluster_id, age\nFROM `project.dataset.clusters`")
+    assert query.endswith("ORDER BY cluster_id\nLIMIT 10 OFFSET 20")
+
+
+def test_list_filters_use_in_unnest_with_typed_arrays():
+    query, params = build_clusters_query(TABLE, {
+        "content_interest": ["esportes", "noticias"],
+        "age": [np.int64(25), np.int64(30)],
+        "is_subscriber": [True],
+        "location": [],
+    })
+    assert "content_interest IN UNNEST(@content_interest)" in query
+    assert "age IN UNNEST(@age)" in query
+    assert "is_subscriber IN UNNEST(@is_subscriber)" in query
+    assert "location" not in query
+    assert params == [
+        QueryParam("content_interest", "STRING", ["esportes", "noticias"], is_array=True),
+        QueryParam("is_subscriber", "BOOL", [True], is_array=True),
+        QueryParam("age", "INT64", [25, 30], is_array=True),
+    ]
+    assert type(params[2].value[0]) is int
+
+
+def test_range_filters_use_between():
+    query, params = build_clusters_query(TABLE, {
+        "access_time_range": (time(8, 0), time(12, 30)),
+        "daily_minutes_range": (10.0, 60.0),
+    })
+    assert "access_time BETWEEN @access_time_range_min AND @access_time_range_max" in query
+    assert "avg_daily_minutes BETWEEN @daily_minutes_range_min AND @daily_minutes_range_max" in query
+    assert params == [
+        QueryParam("access_time_range_min", "TIME", time(8, 0)),
+        QueryParam("access_time_range_max", "TIME", time(12, 30)),
+        QueryParam("daily_minutes_range_min", "FLOAT64", 10.0),
+        QueryParam("daily_minutes_range_max", "FLOAT64", 60.0),
+    ]
+
+
+def test_predicates_are_combined_with_and():
+    query, _ = build_clusters_query(TABLE, {"device_type": ["mobile"], "daily_minutes_range": (1.0, 2.0)})
+    assert ("WHERE device_type IN UNNEST(@device_type)\n"
+            "  AND avg_daily_minutes BETWEEN @daily_minutes_range_min AND @daily_minutes_range_max") in query
+
+
+def test_keyset_paging():
+    query, params = build_clusters_query(TABLE, after_cluster_id="cluster_0099", limit=100)
+    assert "WHERE cluster_id > @after_cluster_id" in query
+    assert query.endswith("LIMIT 100")
+    assert params == [QueryParam("after_cluster_id", "STRING", "cluster_0099")]
+
+
+def test_changed_since():
+    watermark = datetime(2025, 8, 20, 19, 8, tzinfo=timezone.utc)
+    query, params = build_clusters_query(TABLE, changed_since=("updated_at", watermark))
+    assert "WHERE updated_at > @watermark" in query
+    assert params == [QueryParam("watermark", "TIMESTAMP", watermark)]
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"columns": ["cluster_id; DROP TABLE x"]},
+    {"changed_since": ("updated_at > 0 OR 1", 0)},
+])
+def test_rejects_unsafe_identifiers(kwargs):
+    with pytest.raises(ValueError):
+        build_clusters_query(TABLE, **kwargs)
+
+
+def test_table_ref_rejects_unsafe_names():
+    with pytest.raises(ValueError):
+        table_ref("project", "dataset", "clusters` WHERE 1=1 --")
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from benchmarks.check_import_time import DEFAULT_BUDGET_MS, FORBIDDEN_AT_STARTUP, check
+
+# Runs the startup imports in fresh interpreters with `python -X importtime`; see
+# benchmarks/check_import_time.py for the command-line version.
+
+
+def test_startup_imports_stay_within_budget():
+    total_ms, best, failures = check(DEFAULT_BUDGET_MS, repeat=3)
+    loaded = {name.strip() for name in best}
+    assert not [module for module in FORBIDDEN_AT_STARTUP if module in loaded]
+    assert total_ms <= DEFAULT_BUDGET_MS
+    assert failures == []
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+import pytest
+
+from services.rule_engine import apply_rules, compute_channel, compute_offer, compute_send_time, rule_plan
+
+# The expected values are the literal strings of SYSTEM_INSTRUCTION, not the tables
+# of the module under test.
+
+
+# ------------------------------
+# 1) Canal
+# ------------------------------
+@pytest.mark.parametrize("engagement, device, age, expected", [
+    ("push", "desktop", 70, "Push"),
+    ("Email", "mobile", 20, "Email"),
+    (None, "mobile", 18, "Push"),
+    (None, "Mobile", 44, "Push"),
+    (None, "mobile", 45, "Email"),
+    (None, "desktop", 30, "Email"),
+    (None, "mobile", 70, "Email"),
+    (None, None, None, "Email"),
+])
+def test_channel(engagement, device, age, expected):
+    df = pd.DataFrame([{"previous_engagement": engagement, "device_type": device, "age": age}])
+    assert compute_channel(df).tolist() == [expected]
+
+
+def test_channel_previous_engagement_takes_precedence():
+    df = pd.DataFrame([
+        {"previous_engagement": "email", "device_type": "mobile", "age": 25},
+        {"previous_engagement": "push", "device_type": "desktop", "age": 60},
+    ])
+    assert compute_channel(df).tolist() == ["Email", "Push"]
+
+
+# ------------------------------
+# 2) Horário
+# ------------------------------
+@pytest.mark.parametrize("access_time", ["19:08:00", "2025-08-20T19:08:00-03:00", "19:59"])
+def test_send_time_before_peak_hour(access_time):
+    df = pd.DataFrame([{"access_time": access_time, "age": 70}])
+    assert compute_send_time(df).tolist() == ["19:45"]
+
+
+def test_send_time_pads_the_hour():
+    df = pd.DataFrame([{"access_time": "7:30:00", "age": 30}])
+    assert compute_send_time(df).tolist() == ["07:45"]
+
+
+@pytest.mark.parametrize("age, expected", [
+    (18, "12:45"),
+    (24, "12:45"),
+    (25, "12:45"),
+    (44, "12:45"),
+    (45, "10:45"),
+    (64, "10:45"),
+    (65, "09:30"),
+    (90, "09:30"),
+])
+def test_send_time_age_band_default(age, expected):
+    df = pd.DataFrame([{"access_time": None, "age": age}])
+    assert compute_send_time(df).tolist() == [expected]
+
+
+def test_send_time_ambiguous_window():
+    df = pd.DataFrame([{"access_time": None, "age": None}])
+    assert compute_send_time(df).tolist() == ["10h ou 14h"]
+
+
+# ------------------------------
+# 3) Oferta
+# ------------------------------
+@pytest.mark.parametrize("interest, is_subscriber, expected", [
+    ("esportes", False, "7 dias grátis do streaming esportivo"),
+    ("noticias", False, "Acesso gratuito por 24h a conteúdos premium"),
+    ("receitas", False, "Coleção/ebook da semana"),
+    ("esportes", True, "Conteúdo exclusivo"),
+    ("noticias", True, "Série especial"),
+    ("receitas", True, "Cardápio da semana"),
+])
+def test_offer_by_interest_and_subscription(interest, is_subscriber, expected):
+    df = pd.DataFrame([{"content_interest": interest, "is_subscriber": is_subscriber}])
+    assert compute_offer(df).tolist() == [expected]
+
+
+def test_offer_normalizes_interest_and_subscriber():
+    df = pd.DataFrame([
+        {"content_interest": " Notícias ", "is_subscriber": "sim"},
+        {"content_interest": "Esportes", "is_subscriber": "false"},
+    ])
+    assert compute_offer(df).tolist() == ["Série especial", "7 dias grátis do streaming esportivo"]
+
+
+def test_offer_fallback_for_other_interests():
+    df = pd.DataFrame([
+        {"content_interest": "games", "is_subscriber": False},
+        {"content_interest": None, "is_subscriber": True},
+    ])
+    assert compute_offer(df).tolist() == ["Teste gratuito", "Benefício de fidelidade"]
+
+
+# ------------------------------
+# 4) Plan
+# ------------------------------
+def test_rule_plan_matches_apply_rules():
+    rows = [
+        {"cluster_id": 1, "previous_engagement": None, "device_type": "mobile", "age": 22,
+         "access_time": "20:10:00", "content_interest": "esportes", "is_subscriber": False},
+        {"cluster_id": 2, "previous_engagement": "email", "device_type": "desktop", "age": 58,
+         "access_time": None, "content_interest": "receitas", "is_subscriber": True},
+    ]
+    assert rule_plan(rows) == {
+        "1": {"canal": "Push", "horario": "20:45", "oferta": "7 dias grátis do streaming esportivo"},
+        "2": {"canal": "Email", "horario": "10:45", "oferta": "Cardápio da semana"},
+    }
+    assert apply_rules(pd.DataFrame(rows))["cluster_id"].tolist() == ["1", "2"]
+    assert rule_plan([]) == {}
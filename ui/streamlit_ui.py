@@ -9,18 +9,25 @@ project_root = Path(__file__).parent.parent
 if str(project_root) not in sys.path:
     sys.path.append(str(project_root))
 
-print("sys.path após a modificação:")
-for p in sys.path:
-    print(f"  - {p}")
-
 import os
 import logging
 import pandas as pd
 from datetime import datetime, timezone, time
 import streamlit as st # type: ignore
-from services.bq_service import get_marketing_clusters # type: ignore
-from services.gemini_service import suggest_campaign_from_cluster
-from config.settings import MODEL_GEMINI, get_api_key
+from services.filter_index import FilterIndex
+from services.snapshot_service import SnapshotStore, bigquery_source
+from services.gemini_service import (
+    COPY_SYSTEM_INSTRUCTION, default_tiers, repair_stats, route_campaign_from_cluster,
+    route_campaigns_for_clusters, routing_stats, suggest_copy_for_cluster, suggest_copy_for_clusters
+)
+from services.cache_service import get_default_cache, make_cache_key
+from services.job_queue import JobStatus, get_default_queue
+from services.metrics import get_default_metrics
+from services.prompt_encoding import encoding_stats
+from services.result_store import get_default_store
+from services.dedup_service import suggest_with_dedup
+from services.rule_engine import apply_rules
+from config.settings import CLUSTER_COLUMNS, MODEL_GEMINI, MODEL_ROUTING, SNAPSHOT_REFRESH_SECONDS, get_api_key
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -39,27 +46,168 @@ def convert_timestamp_to_days_ago(timestamp):
         return 0  # Handle potential missing values
     return (now - timestamp).days
 
-@st.cache_data
+def to_gemini_input(row: dict) -> dict:
+    # time values are not JSON serializable, so send them as "HH:MM:SS"
+    return {
+        key: value.strftime('%H:%M:%S') if isinstance(value, time) else value
+        for key, value in row.items()
+    }
+
+# Models that can answer a request: fast model first, escalating to MODEL_GEMINI
+GENERATION_MODELS = [tier.model_name for tier in default_tiers()] if MODEL_ROUTING else [MODEL_GEMINI]
+GENERATION_MODEL_LABEL = " → ".join(GENERATION_MODELS)
+
+def generate_for_clusters(filtered_df: pd.DataFrame, notes: str, api_key: str) -> dict:
+    # Canal, horário and oferta come from the local rules; Gemini only writes the copy,
+    # once per group of clusters with the same profile
+    rows = [to_gemini_input(row) for row in filtered_df.to_dict("records")]
+    rules = apply_rules(filtered_df)
+    plan = {record.pop("cluster_id"): record for record in rules.to_dict("records")}
+    campaigns, dedup_report = suggest_with_dedup(
+        rows, notes, api_key=api_key,
+        generate=lambda representatives: (
+            route_campaigns_for_clusters(representatives, notes, api_key, generate=suggest_copy_for_clusters, plan=plan)
+            if MODEL_ROUTING else suggest_copy_for_clusters(representatives, notes, api_key=api_key, plan=plan)
+        ),
+        overrides={cluster_id: {"horario": fields["horario"]} for cluster_id, fields in plan.items()},
+    )
+    # Each campaign is stored under the model that wrote it (the routed tier, if any)
+    stored = []
+    for row in rows:
+        campaign = dict(campaigns.get(str(row["cluster_id"])) or {})
+        if campaign:
+            model_name = campaign.pop("model", MODEL_GEMINI)
+            stored.append((row["cluster_id"], {"campanhas": [campaign]}, model_name,
+                           make_cache_key(row, notes, model_name, COPY_SYSTEM_INSTRUCTION), notes))
+    get_default_store().add_many(stored)
+    return {
+        "campanhas": list(campaigns.values()),
+        "clusters": dedup_report.clusters,
+        "groups": dedup_report.groups,
+        "ratio": dedup_report.ratio,
+    }
+
+def show_job_result(label: str, job):
+    if job.status in (JobStatus.PENDING, JobStatus.RUNNING):
+        st.info(f"⏳ {label}: gerando... ({job.elapsed_s:.0f}s)")
+    elif job.status == JobStatus.FAILED:
+        st.error(f"{label}: ocorreu um erro ao chamar o Gemini: {job.error}")
+    elif "clusters" in job.result:
+        result = job.result
+        missing = result["clusters"] - len(result["campanhas"])
+        st.caption(
+            f"{result['clusters']} clusters agrupados em {result['groups']} perfis "
+            f"({result['ratio']:.1f} clusters por grupo; só um por grupo vai ao Gemini)."
+        )
+        if missing:
+            st.warning(f"{label}: {missing} clusters ficaram sem campanha.")
+        else:
+            st.success(f"{label}: campanhas geradas com sucesso!")
+        st.dataframe(pd.DataFrame(result["campanhas"]), use_container_width=True)
+    else:
+        st.success(f"{label}: sugestão de campanha gerada com sucesso!")
+        st.json(job.result)
+
+def show_stored_result(cluster_id, prompt_hashes: list):
+    # Previous generations are shown right away, without calling Gemini
+    store = get_default_store()
+    matches = [store.latest(cluster_id, prompt_hash=prompt_hash) for prompt_hash in prompt_hashes]
+    exact = max((match for match in matches if match is not None), key=lambda match: match.id, default=None)
+    latest = exact or store.latest(cluster_id)
+    if latest is None:
+        return None
+    created_at = datetime.fromtimestamp(latest.created_at).strftime('%d/%m/%Y %H:%M')
+    title = "Sugestão já gerada para este pedido" if exact else "Última sugestão salva deste cluster"
+    st.markdown(f"### 🗂️ {title}")
+    st.caption(f"Gerada em {created_at} com `{latest.model}`" + (f" — objetivo: {latest.user_notes}" if latest.user_notes else ""))
+    st.json(latest.suggestion)
+    history = store.history(cluster_id)
+    if len(history) > 1:
+        with st.expander(f"Histórico ({len(history)} versões)"):
+            for version in history:
+                st.caption(f"{datetime.fromtimestamp(version.created_at).strftime('%d/%m/%Y %H:%M')} — `{version.model}`")
+                st.json(version.suggestion, expanded=False)
+    return exact
+
+@st.fragment(run_every=2)
+def show_generation_jobs():
+    # Polls the background jobs of this session; only this fragment reruns
+    jobs = get_default_queue().jobs(list(st.session_state.generation_jobs.values()))
+    if not jobs:
+        return
+    st.markdown("### 🤖 Respostas do Gemini")
+    for label, job_id in list(st.session_state.generation_jobs.items()):
+        job = jobs.get(job_id)
+        if job is None:
+            # expired from the queue
+            st.session_state.generation_jobs.pop(label)
+            continue
+        show_job_result(label, job)
+    if all(job.finished for job in jobs.values()) and st.button("Limpar respostas", key="clear_jobs_button"):
+        st.session_state.generation_jobs = {}
+        st.rerun()
+
+# Multiselect filters: column -> label
+FILTER_LABELS = {
+    "content_interest": "Interesse",
+    "location": "Localização",
+    "previous_engagement": "Engajamento Anterior",
+    "is_subscriber": "É Assinante",
+    "device_type": "Tipo de Dispositivo",
+    "age": "Idade",
+}
+
+BQ_TABLE_PROJECT_ID = 'BQ_TABLE_PROJECT_ID'
+BQ_DATASET_ID = 'BQ_DATASET_ID'
+BQ_TABLE_ID = 'BQ_TABLE_ID'
+
+@st.cache_resource
+def get_snapshot_store():
+    return SnapshotStore()
+
+@st.cache_data(ttl=SNAPSHOT_REFRESH_SECONDS)
 def load_and_prepare_data():
-    BQ_TABLE_PROJECT_ID = 'BQ_TABLE_PROJECT_ID'
-    BQ_DATASET_ID = 'BQ_DATASET_ID'
-    BQ_TABLE_ID = 'BQ_TABLE_ID'
-    
-    all_cluster_rows = get_marketing_clusters(BQ_TABLE_PROJECT_ID, BQ_DATASET_ID, BQ_TABLE_ID)
-    
-    if not all_cluster_rows:
-        return pd.DataFrame(), []
+    # Only runs on a cache miss, so the stage times the real load
+    with get_default_metrics().span("load_and_prepare_data") as span:
+        df = _load_and_prepare_data()
+        span["rows"] = len(df)
+    return df, df['cluster_id'].tolist()
+
+def refresh_snapshot(store: SnapshotStore):
+    return store.refresh(bigquery_source(BQ_TABLE_PROJECT_ID, BQ_DATASET_ID, BQ_TABLE_ID, columns=CLUSTER_COLUMNS))
+
+def _load_and_prepare_data() -> pd.DataFrame:
+    # Read the local Parquet snapshot (memory-mapped) and only go to BigQuery
+    # for the rows changed since the last refresh
+    store = get_snapshot_store()
+    age = store.age_seconds()
+    if age is None:
+        # No snapshot yet: nothing to show until the first load finishes
+        table = refresh_snapshot(store)
+    else:
+        if age >= SNAPSHOT_REFRESH_SECONDS:
+            # Stale: refreshed in the background (once for every session), and
+            # picked up by the next reload of the data
+            get_default_queue().submit(refresh_snapshot, store, key="snapshot_refresh")
+        table = store.load()
+    df = table.to_pandas()
     
-    df = pd.DataFrame(all_cluster_rows)
-    print(df)
+    if df.empty:
+        return pd.DataFrame(columns=CLUSTER_COLUMNS)
     
     # Check if the 'last_access' column exists before processing
     if 'last_access' in df.columns:
         # Convert the timestamp column to a timedelta representing days since last access
-        df['last_access'] = df['last_access'].apply(convert_timestamp_to_days_ago)
+        with get_default_metrics().span("last_access", rows=len(df)):
+            df['last_access'] = df['last_access'].apply(convert_timestamp_to_days_ago)
         
-    # Return the processed DataFrame and the list of cluster IDs
-    return df, df['cluster_id'].tolist()
+    return df
+
+@st.cache_resource(ttl=SNAPSHOT_REFRESH_SECONDS)
+def load_filter_index():
+    # Built once per snapshot and shared by every session; it keeps its own DataFrame
+    df, _ = load_and_prepare_data()
+    return FilterIndex(df, columns=list(FILTER_LABELS))
 
 # --------------------------------------------------------------------------
 # Streamlit UI
@@ -92,6 +240,10 @@ if not api_key:
     )
     st.stop() # Halt further execution if the key is missing or invalid
 
+# Background generation jobs of this session: label -> job id
+if "generation_jobs" not in st.session_state:
+    st.session_state.generation_jobs = {}
+
 # Initialize the session state for filters
 if "filter_state" not in st.session_state:
     st.session_state.filter_state = {
@@ -119,93 +271,40 @@ if st.button("Resetar Filtros", key="reset_button"):
         "daily_minutes_range": None,
         "age": []
     }
+    for column in FILTER_LABELS:
+        st.session_state.pop(f"filter_{column}", None)
     st.rerun()
 
-all_df, cluster_ids_for_selectbox = load_and_prepare_data()
+filter_index = load_filter_index()
+all_df = filter_index.frame
 
 if all_df.empty:
     st.warning("⚠️ Não foi possível carregar os clusters do BigQuery.", icon="🚨")
 else:
-    # Create columns for the filters
-    col1, col2, col3, col4, col5, col6 = st.columns(6)
-
-    # 1. Filter Widgets
-    with col1:
-        options = all_df['content_interest'].unique().tolist()
-        selected_options = st.multiselect(
-            "Interesse",
-            options=options,
-            default=st.session_state.filter_state.get("content_interest", [])
-        )
-        st.session_state.filter_state["content_interest"] = selected_options
-    
-    with col2:
-        options = all_df['location'].unique().tolist()
-        selected_options = st.multiselect(
-            "Localização",
-            options=options,
-            default=st.session_state.filter_state.get("location", [])
-        )
-        st.session_state.filter_state["location"] = selected_options
-    
-    with col3:
-        options = all_df['previous_engagement'].unique().tolist()
-        selected_options = st.multiselect(
-            "Engajamento Anterior",
-            options=options,
-            default=st.session_state.filter_state.get("previous_engagement", [])
-        )
-        st.session_state.filter_state["previous_engagement"] = selected_options
-    
-    with col4:
-        options = all_df['is_subscriber'].unique().tolist()
-        selected_options = st.multiselect(
-            "É Assinante",
-            options=options,
-            default=st.session_state.filter_state.get("is_subscriber", [])
-        )
-        st.session_state.filter_state["is_subscriber"] = selected_options
-        
-    with col5:
-        options = all_df['device_type'].unique().tolist()
-        selected_options = st.multiselect(
-            "Tipo de Dispositivo",
-            options=options,
-            default=st.session_state.filter_state.get("device_type", [])
-        )
-        st.session_state.filter_state["device_type"] = selected_options
-
-    with col6:
-        options = all_df['age'].unique().tolist()
-        selected_options = st.multiselect(
-            "Idade",
-            options=options,
-            default=st.session_state.filter_state.get("age", [])
-        )
-        st.session_state.filter_state["age"] = selected_options
-
-
-    # 2. Apply the filters to the DataFrame
-    filtered_df = all_df.copy()
+    # Selections of this rerun (widget state is already updated before the widgets render)
+    current_filters = {
+        column: st.session_state.get(f"filter_{column}", st.session_state.filter_state.get(column, []))
+        for column in FILTER_LABELS
+    }
 
-    # Apply filters only if the list of selected options is not empty
-    if st.session_state.filter_state["content_interest"]:
-        filtered_df = filtered_df[filtered_df['content_interest'].isin(st.session_state.filter_state["content_interest"])]
-    
-    if st.session_state.filter_state["location"]:
-        filtered_df = filtered_df[filtered_df['location'].isin(st.session_state.filter_state["location"])]
-        
-    if st.session_state.filter_state["previous_engagement"]:
-        filtered_df = filtered_df[filtered_df['previous_engagement'].isin(st.session_state.filter_state["previous_engagement"])]
+    # Option counts and filtering are timed as the "filter" stage
+    with get_default_metrics().span("filter") as filter_span:
+        # 1. Filter Widgets, one column each, with the number of clusters per option
+        for column, container in zip(FILTER_LABELS, st.columns(len(FILTER_LABELS))):
+            with container:
+                counts = filter_index.option_counts(column, current_filters)
+                selected_options = st.multiselect(
+                    FILTER_LABELS[column],
+                    options=filter_index.options(column),
+                    default=st.session_state.filter_state.get(column, []),
+                    format_func=lambda value, counts=counts: f"{value} ({counts.get(value, 0)})",
+                    key=f"filter_{column}"
+                )
+                st.session_state.filter_state[column] = selected_options
 
-    if st.session_state.filter_state["is_subscriber"]:
-        filtered_df = filtered_df[filtered_df['is_subscriber'].isin(st.session_state.filter_state["is_subscriber"])]
-        
-    if st.session_state.filter_state["device_type"]:
-        filtered_df = filtered_df[filtered_df['device_type'].isin(st.session_state.filter_state["device_type"])]
-
-    if st.session_state.filter_state["age"]:
-        filtered_df = filtered_df[filtered_df['age'].isin(st.session_state.filter_state["age"])]
+        # 2. Apply the filters (bitmap index, no DataFrame copy)
+        filtered_df = filter_index.filter(st.session_state.filter_state)
+        filter_span["rows"] = len(filtered_df)
 
     # 3. Display the filtered table
     st.markdown("<br>", unsafe_allow_html = True)
@@ -216,6 +315,17 @@ else:
     # Allow user to select cluster
     cluster_ids_for_filtered_selectbox = filtered_df['cluster_id'].unique().tolist()
     
+    if cluster_ids_for_filtered_selectbox:
+        # Bulk generation: several clusters per Gemini request
+        with st.expander(f"🚀 Gerar campanhas para todos os {len(cluster_ids_for_filtered_selectbox)} clusters filtrados"):
+            bulk_notes = st.text_area("Objetivo de negócio/campanha para todos os clusters filtrados:", key="bulk_notes_input")
+            if st.button("Gerar para todos os clusters filtrados", key="bulk_generate_button"):
+                # Runs in the background: reruns don't lose it and the page stays responsive
+                label = f"Lote de {len(filtered_df)} clusters"
+                st.session_state.generation_jobs[label] = get_default_queue().submit(
+                    generate_for_clusters, filtered_df, bulk_notes, api_key
+                )
+
     if not cluster_ids_for_filtered_selectbox:
         st.warning("Nenhum cluster encontrado com os filtros selecionados.")
         selected_cluster_id = None
@@ -232,42 +342,94 @@ else:
         st.session_state.filter_state["additional_notes"] = additional_notes
 
         cluster_details = filtered_df[filtered_df['cluster_id'] == selected_cluster_id].iloc[0]
-        cluster_details_dict = cluster_details.to_dict()
-        
-        for key, value in cluster_details_dict.items():
-            if isinstance(value, time):
-                cluster_details_dict[key] = value.strftime('%H:%M:%S')
+        cluster_details_dict = to_gemini_input(cluster_details.to_dict())
 
         cluster_details_dict["additional_notes"] = st.session_state.filter_state.get("additional_notes", "")
         
         st.markdown(f"### ✨ Dados de Entrada para o Gemini do Cluster `{selected_cluster_id}`")
         st.json(cluster_details_dict)
         
+        notes = st.session_state.filter_state.get("additional_notes", "")
+        # The request is stored under the model that answered it
+        prompt_hashes = [make_cache_key(cluster_details_dict, notes, model_name, COPY_SYSTEM_INSTRUCTION)
+                         for model_name in GENERATION_MODELS]
+        stored_result = show_stored_result(selected_cluster_id, prompt_hashes)
+
+        refresh_cache = st.checkbox("Ignorar cache e gerar novamente", key="refresh_cache_checkbox")
+
         if st.button("Gerar Sugestão de Campanha com Gemini", key="generate_button"):
-            with st.spinner("Gerando sugestão de campanha... (isso pode levar alguns segundos)"):
-                try:
-                    # Pass the API key explicitly
-                    gemini_api_key = os.environ.get('GEMINI_API_KEY')
-                    if not gemini_api_key:
-                        st.error("Erro: A chave da API do Gemini não foi encontrada. Verifique sua configuração.")
-                        st.stop()
-                    
-                    campaign_suggestion = suggest_campaign_from_cluster(
-                        cluster_details_dict,
-                        st.session_state.filter_state.get("additional_notes", ""),
-                        api_key=gemini_api_key
-                    )
-                    st.success("Sugestão de campanha gerada com sucesso!")
-                    st.markdown("### 🤖 Resposta do Gemini")
-                    st.json(campaign_suggestion)
-                except Exception as e:
-                    st.error(f"Ocorreu um erro ao chamar o Gemini: {e}")
-                    st.exception(e)
+            # Pass the API key explicitly
+            gemini_api_key = os.environ.get('GEMINI_API_KEY')
+            if not gemini_api_key:
+                st.error("Erro: A chave da API do Gemini não foi encontrada. Verifique sua configuração.")
+                st.stop()
+
+            if stored_result is not None and not refresh_cache:
+                st.info("Esta sugestão já foi gerada (veja acima). Marque 'Ignorar cache' para gerar outra.")
+            else:
+                # Identical requests in flight (from any session) share one Gemini call.
+                # As in the bulk path, canal, horário and oferta come from the local rules
+                routing_kwargs = {"suggest": suggest_copy_for_cluster} if MODEL_ROUTING else {}
+                st.session_state.generation_jobs[f"Cluster {selected_cluster_id}"] = get_default_queue().submit(
+                    route_campaign_from_cluster if MODEL_ROUTING else suggest_copy_for_cluster,
+                    cluster_details_dict,
+                    notes,
+                    api_key=gemini_api_key,
+                    **routing_kwargs,
+                    cache=get_default_cache(),
+                    refresh=refresh_cache,
+                    store=get_default_store(),
+                    key=(prompt_hashes[-1], refresh_cache),
+                )
+
+    show_generation_jobs()
 
 # --- Sidebar Information Display ---
 st.sidebar.divider()
 st.sidebar.header("Detalhes do Assistente")
-st.sidebar.caption(f"**LLM:** `{MODEL_GEMINI}`")
+st.sidebar.caption(f"**LLM:** `{GENERATION_MODEL_LABEL}`")
 st.sidebar.caption("Powered by Google Agent Development Kit.")
 
+cache_stats = get_default_cache().stats
+st.sidebar.caption(
+    f"**Cache:** {cache_stats.hits} hits / {cache_stats.misses} misses "
+    f"({cache_stats.hit_rate:.0%}), {cache_stats.saved_latency_s:.1f}s economizados"
+)
+st.sidebar.caption(
+    f"**Correções:** {repair_stats.repair_requests} requisições em {repair_stats.repaired_responses} respostas "
+    f"({repair_stats.repair_latency_s:.1f}s), {repair_stats.items_failed} campanhas descartadas"
+)
+if routing_stats.requests:
+    st.sidebar.caption(
+        f"**Roteamento:** {routing_stats.escalation_rate:.0%} escalados; " + "; ".join(
+            f"`{name}` {tier.success_rate:.0%} ok em {tier.mean_latency_s:.1f}s"
+            for name, tier in routing_stats.tiers.items()
+        )
+    )
+st.sidebar.caption(
+    f"**Prompt:** ~{encoding_stats.saved_per_row:.0f} tokens economizados por cluster "
+    f"({encoding_stats.encoded_tokens} enviados em vez de {encoding_stats.raw_tokens})"
+)
+
+# Recent latency of each hot-path stage (see services/metrics.py)
+metrics = get_default_metrics()
+stage_summary = metrics.summary()
+if stage_summary:
+    with st.sidebar.expander("⏱️ Desempenho"):
+        st.dataframe(
+            pd.DataFrame.from_dict(stage_summary, orient="index").rename_axis("etapa"),
+            use_container_width=True,
+        )
+        totals = metrics.totals()
+        bigquery_totals, gemini_totals = totals.get("bigquery", {}), totals.get("gemini", {})
+        st.caption(
+            f"**BigQuery:** {bigquery_totals.get('rows', 0):.0f} linhas, "
+            f"{bigquery_totals.get('bytes_processed', 0) / 2**20:.1f} MB processados"
+        )
+        st.caption(
+            f"**Gemini:** {gemini_totals.get('prompt_tokens', 0):.0f} tokens de prompt, "
+            f"{gemini_totals.get('output_tokens', 0):.0f} de resposta, "
+            f"{gemini_totals.get('retries', 0):.0f} correções, {gemini_totals.get('cache_hit', 0):.0f} hits de cache"
+        )
+
 print("✅ Renderização da UI do Streamlit completa.")
\ No newline at end of file